@@ -0,0 +1,61 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# codetokencalculator/codetokencalculator/_fast.pyx
+
+"""
+Compiled version of the per-segment counting loop of tokenizer.py, built with Cython
+when it is available at install time. tokenizer.py falls back to its pure-Python
+`_count_segments_py` (which this mirrors exactly) when this extension is not built.
+"""
+
+
+cpdef Py_ssize_t count_segments(
+    str text_content,
+    object split_points,
+    dict segment_counts,
+    object count_tokens,
+    object encoding_name,
+    Py_ssize_t max_segment_length,
+    Py_ssize_t max_entries
+) except -1:
+    """
+    Sums the token counts of the segments of `text_content` ending at `split_points`
+    (match objects) and at the end of the text, looking each segment up in
+    `segment_counts` first and storing the counts of new short segments in it
+    (emptying it first if it holds `max_entries`).
+    """
+    cdef Py_ssize_t token_count = 0
+    cdef Py_ssize_t start = 0
+    cdef Py_ssize_t end
+    cdef Py_ssize_t length = len(text_content)
+    cdef str segment
+
+    for split_point in split_points:
+        end = split_point.end()
+        if end == start:
+            continue # Empty segment, skipped like the pure-Python version does
+        segment = text_content[start:end]
+        start = end
+        token_count += _count_segment(segment, segment_counts, count_tokens, encoding_name, max_segment_length, max_entries)
+    if start < length:
+        segment = text_content[start:]
+        token_count += _count_segment(segment, segment_counts, count_tokens, encoding_name, max_segment_length, max_entries)
+    return token_count
+
+
+cdef inline Py_ssize_t _count_segment(
+    str segment,
+    dict segment_counts,
+    object count_tokens,
+    object encoding_name,
+    Py_ssize_t max_segment_length,
+    Py_ssize_t max_entries
+) except -1:
+    cached_count = segment_counts.get(segment)
+    if cached_count is not None:
+        return cached_count
+    segment_count = count_tokens(segment, encoding_name)
+    if len(segment) <= max_segment_length:
+        if len(segment_counts) >= max_entries:
+            segment_counts.clear()
+        segment_counts[segment] = segment_count
+    return segment_count
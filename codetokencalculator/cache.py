@@ -0,0 +1,127 @@
+# codetokencalculator/codetokencalculator/cache.py
+
+"""
+Persistent cache of per-file token counts, so that files which have not changed
+since a previous run are not read and tokenized again.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+from .tokenizer import get_tokenizer_id
+
+# Location of the cache database, following the XDG base directory convention
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "codetokencalculator"
+CACHE_FILE = CACHE_DIR / "counts.db"
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS counts (
+    path TEXT NOT NULL,
+    encoding TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sample_sha1 TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    ntokens INTEGER NOT NULL,
+    status TEXT,
+    PRIMARY KEY (path, encoding)
+)
+"""
+
+
+def make_cache_key(file_stat: os.stat_result, sample: bytes, mode: str) -> list:
+    """
+    Builds the key identifying one version of a file's content.
+
+    Args:
+        file_stat: The result of stat-ing the file.
+        sample: The leading bytes of the file (the binary-sniff sample).
+        mode: How the file is tokenized (e.g. whole or in chunks), since that can change the count.
+
+    Returns:
+        [st_mtime_ns, st_size, sha1-of-sample, mode].
+    """
+    return [file_stat.st_mtime_ns, file_stat.st_size, hashlib.sha1(sample).hexdigest(), mode]
+
+
+class TokenCountCache:
+    """
+    Token counts keyed by absolute file path and tokenizer, stored in an SQLite database at CACHE_FILE.
+
+    Each entry remembers the key (see `make_cache_key`) it was computed for, and is
+    only returned while the file still has that key. Entries are per tokenizer (library
+    and encoding), so counts made with a different tokenizer are never returned.
+
+    New counts are held in memory and written in a single transaction by `save`.
+    If the database cannot be opened, the cache simply never hits.
+    """
+
+    def __init__(self, cache_file: Path = CACHE_FILE):
+        self.cache_file = cache_file
+        self.tokenizer_id = get_tokenizer_id()
+        self._pending = []
+        self._lock = threading.Lock() # One connection, shared by the worker threads
+        self._connection = None
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(str(cache_file), check_same_thread=False)
+            self._connection.execute(_CREATE_TABLE)
+        except (OSError, sqlite3.Error):
+            self.close() # Unusable cache, run without it
+
+    def get(self, file_path: str, key: list) -> Optional[Tuple[int, Optional[str]]]:
+        """
+        Returns the cached (token_count, status_message) for a file, or None on a miss.
+        """
+        if self._connection is None:
+            return None
+        with self._lock:
+            try:
+                row = self._connection.execute(
+                    "SELECT mtime, size, sample_sha1, mode, ntokens, status FROM counts"
+                    " WHERE path = ? AND encoding = ?",
+                    (file_path, self.tokenizer_id)
+                ).fetchone()
+            except sqlite3.Error:
+                return None
+        if row is None or list(row[:4]) != key:
+            return None
+        return row[4], row[5]
+
+    def put(self, file_path: str, key: list, token_count: int, status_msg: Optional[str]) -> None:
+        """
+        Stores the token count computed for a file with the given key.
+        """
+        with self._lock:
+            self._pending.append((file_path, self.tokenizer_id, *key, token_count, status_msg))
+
+    def save(self) -> None:
+        """
+        Writes the new counts to disk. Failures are ignored; the cache is only an optimisation.
+        """
+        with self._lock:
+            if not self._pending or self._connection is None:
+                return
+            try:
+                with self._connection: # One transaction for the whole run
+                    self._connection.executemany(
+                        "INSERT OR REPLACE INTO counts"
+                        " (path, encoding, mtime, size, sample_sha1, mode, ntokens, status)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        self._pending
+                    )
+                self._pending = []
+            except sqlite3.Error:
+                pass
+
+    def close(self) -> None:
+        """
+        Closes the database connection. Counts not yet saved are discarded.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
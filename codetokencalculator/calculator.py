@@ -4,15 +4,27 @@
 Core logic for scanning directories, processing files, and counting tokens.
 """
 
+import fnmatch
+import io
 import os
 import re
-import re
+from array import array
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Set
-from .tokenizer import count_tokens_for_text
+from typing import Iterator, List, Optional, Set, Tuple, Union
+from .cache import TokenCountCache, make_cache_key
+from .tokenizer import count_tokens_for_pieces, count_tokens_for_text, init_tokenizer, iter_text_pieces
+
+try:
+    # Optional: google-re2 matches in linear time, so pathological user patterns cannot blow up
+    import re2
+except ImportError:
+    re2 = None
 
 # Default directories to exclude from scanning
-DEFAULT_EXCLUDE_DIRS = {
+DEFAULT_EXCLUDE_DIRS = frozenset({
     ".git",
     "__pycache__",
     "node_modules",
@@ -25,11 +37,11 @@ DEFAULT_EXCLUDE_DIRS = {
     ".venv",
     "target", # For Rust/Java
     "*.egg-info" # Python packaging
-}
+})
 
 # Default file extensions to consider as text/code.
-# Using a set for efficient lookup.
-DEFAULT_INCLUDE_EXTENSIONS = {
+# Using a frozenset for efficient lookup.
+DEFAULT_INCLUDE_EXTENSIONS = frozenset({
     # Common code files
     ".py", ".js", ".jsx", ".ts", ".tsx", ".java", ".c", ".cpp", ".h", ".hpp",
     ".cs", ".go", ".rs", ".rb", ".php", ".swift", ".kt", ".kts", ".scala",
@@ -42,19 +54,40 @@ DEFAULT_INCLUDE_EXTENSIONS = {
     # Note: .ipynb files are JSON, tokenizing the whole thing might not be what users expect
     # if they only care about code cells. For now, we treat it as a text file.
     ".ipynb"
-}
+})
+# Lowercased copy of DEFAULT_INCLUDE_EXTENSIONS, matched against lowercased file suffixes
+INCLUDE_EXTENSIONS_LC = frozenset(ext.lower() for ext in DEFAULT_INCLUDE_EXTENSIONS)
+
 # Files without extensions but are typically text
-TEXT_FILENAMES_WITHOUT_EXTENSION = {
+TEXT_FILENAMES_WITHOUT_EXTENSION = frozenset({
     "Dockerfile",
     "Makefile",
     "Jenkinsfile",
     "LICENSE",
     "README" # Often .md, but sometimes without extension
-}
+})
+
+# Number of worker threads used to process files. Per-file work is dominated by
+# open/read syscalls, so we oversubscribe the CPU count.
+DEFAULT_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Below this many candidate files, the thread pool costs more than it saves.
+PARALLEL_MIN_FILES = 4
+
+
+# Number of leading bytes inspected for null bytes when sniffing binary content
+BINARY_SNIFF_SIZE = 4096
+
+
+# Matches any non-whitespace byte; used to spot empty/whitespace-only files from the sniffed sample
+_NON_WHITESPACE_BYTE = re.compile(rb"\S")
+
+# Files larger than this are streamed and tokenized in pieces to bound memory use (unless `exact` is set)
+CHUNK_THRESHOLD = 4 * 1024 * 1024
 
 
 # Heuristic to detect binary files by checking for null bytes in the first few KB
-def is_binary_file(filepath: Path, sample_size: int = 4096) -> bool:
+def is_binary_file(filepath: Path, sample_size: int = BINARY_SNIFF_SIZE) -> bool:
     """
     Checks if a file is likely binary by looking for null bytes in a sample.
     """
@@ -67,100 +100,636 @@ def is_binary_file(filepath: Path, sample_size: int = 4096) -> bool:
         return True
     return False
 
-def is_likely_text_file(filepath: Path) -> bool:
+def _file_suffix(file_name: str) -> str:
+    """
+    Returns the suffix of a file name (e.g. ".py"), with the same rules as
+    Path.suffix (".gitignore" and "name." have none), but without building a Path.
+    """
+    dot_index = file_name.rfind('.')
+    if 0 < dot_index < len(file_name) - 1:
+        return file_name[dot_index:]
+    return ""
+
+def is_likely_text_file(filepath: Union[str, Path]) -> bool:
     """
     Determines if a file is likely a text file based on its extension or name.
+    Files without an extension are accepted here; their content is sniffed for
+    binary data when they are read in `process_file`.
     """
-    if filepath.suffix.lower() in DEFAULT_INCLUDE_EXTENSIONS:
+    file_name = os.path.basename(filepath)
+    file_suffix = _file_suffix(file_name)
+    if file_suffix.lower() in INCLUDE_EXTENSIONS_LC:
         return True
-    if filepath.name in TEXT_FILENAMES_WITHOUT_EXTENSION:
+    if file_name in TEXT_FILENAMES_WITHOUT_EXTENSION:
         return True
     # If no extension, and not in the explicit list, it's ambiguous.
-    # We might try to read it, but `is_binary_file` will be the main guard.
-    if not filepath.suffix: # No extension
-        return not is_binary_file(filepath) # Check content if no extension
-    return False
+    # The binary check on the file content will be the main guard.
+    return not file_suffix
 
 
-def process_file(filepath: Path, exclude_extensions: Set[str]) -> tuple[Optional[int], Optional[str]]:
+def _skip_reason_for_name(file_name: str, exclude_extensions: Set[str]) -> Optional[str]:
+    """
+    Returns why a file is skipped based on its name alone, or None if its content should be checked.
+    """
+    file_suffix = _file_suffix(file_name)
+    file_extension_lower = file_suffix.lower()
+
+    # 1. Check user-defined excluded extensions (only if file has an extension)
+    if file_extension_lower and file_extension_lower in exclude_extensions:
+        return f"Skipped (excluded extension: {file_extension_lower})"
+
+    # 2. Determine if the file type is generally included (same rules as is_likely_text_file,
+    #    inlined here as this runs once per file)
+    if not (
+        file_extension_lower in INCLUDE_EXTENSIONS_LC
+        or file_name in TEXT_FILENAMES_WITHOUT_EXTENSION
+        or not file_suffix
+    ):
+        return f"Skipped (extension {file_extension_lower} not in default inclusion list)"
+    return None
+
+
+def _count_tokens_streamed(f: io.BufferedIOBase, encoding: str) -> tuple[int, bool]:
+    """
+    Counts the tokens of an open binary file with `tokenizer.iter_text_pieces`, so the
+    whole file never has to be held in memory. Pieces are tokenized in parallel batches.
+
+    Returns:
+        A tuple (token_count, has_non_whitespace).
+
+    Raises:
+        UnicodeDecodeError: If the file cannot be decoded with the given encoding.
+    """
+    f.seek(0)
+    text_stream = io.TextIOWrapper(f, encoding=encoding) # Also applies universal newlines
+    has_non_whitespace = False
+
+    def check_pieces(pieces: Iterator[str]) -> Iterator[str]:
+        nonlocal has_non_whitespace
+        for piece in pieces:
+            if not has_non_whitespace and not piece.isspace():
+                has_non_whitespace = True
+            yield piece
+
+    try:
+        token_count = count_tokens_for_pieces(check_pieces(iter_text_pieces(text_stream)))
+    finally:
+        text_stream.detach() # Leave closing the file to the caller
+    return token_count, has_non_whitespace
+
+
+def _process_large_file(f: io.BufferedIOBase) -> tuple[Optional[int], Optional[str]]:
+    """
+    Counts the tokens of a large file with `_count_tokens_streamed`,
+    trying UTF-8 first and falling back to latin-1.
+    """
+    status_msg = "Processed (counted in chunks)"
+    try:
+        token_count, has_non_whitespace = _count_tokens_streamed(f, "utf-8")
+    except UnicodeDecodeError:
+        # Common fallback for files not in UTF-8; latin-1 can decode any byte sequence
+        token_count, has_non_whitespace = _count_tokens_streamed(f, "latin-1")
+        status_msg = "Processed (counted in chunks, decoded as latin-1)"
+
+    if not has_non_whitespace:
+        return 0, "Empty or whitespace-only file"
+    return token_count, status_msg
+
+
+def process_file(
+    filepath: Union[str, Path],
+    exclude_extensions: Set[str],
+    exact: bool = False,
+    cache: Optional[TokenCountCache] = None,
+    check_name: bool = True
+) -> tuple[Optional[int], Optional[str]]:
     """
     Reads a file and counts its tokens.
 
+    The file is opened once: the first BINARY_SNIFF_SIZE bytes are checked for
+    null bytes, and only if they look like text is the rest of the file read.
+    Files larger than CHUNK_THRESHOLD are streamed in pieces unless `exact` is set.
+
     Args:
-        filepath: Path to the file.
+        filepath: Path to the file, as a string (e.g. os.DirEntry.path) or Path.
+        exclude_extensions: A set of lowercase file extensions (with leading dot) to skip.
+        exact: Read large files whole instead of streaming them, at the cost of memory.
+        cache: Optional cache of token counts. If the file is unchanged since its count was
+            cached (same mtime, size and leading bytes), the cached count is returned without
+            reading the rest of the file; otherwise the new count is stored in it.
+        check_name: Whether to check the file name against exclude_extensions and the inclusion
+            list; False if the caller already did (see `_skip_reason_for_name`).
 
     Returns:
         A tuple (token_count, error_message).
         token_count is None if an error occurs or file is skipped.
-        error_message contains details if an error occurred.
+        error_message contains details if an error occurred, or notes how a counted file was
+        processed (e.g. decoded as latin-1); it is None for a plain UTF-8 file counted whole.
     """
     try:
-        file_extension_lower = filepath.suffix.lower()
-
-        # 1. Check user-defined excluded extensions (only if file has an extension)
-        if file_extension_lower and file_extension_lower in exclude_extensions:
-            return None, f"Skipped (excluded extension: {file_extension_lower})"
-
-        # 2. Determine if the file type is generally included (by is_likely_text_file)
-        #    is_likely_text_file also handles binary check for extension-less files.
-        if not is_likely_text_file(filepath):
-            if file_extension_lower: # Has an extension, but not in our default include list
-                return None, f"Skipped (extension {file_extension_lower} not in default inclusion list)"
-            elif not filepath.suffix and is_binary_file(filepath): # No extension, and was found to be binary by is_likely_text_file
-                return None, "Skipped (binary file without extension)"
-            else: # No extension and not binary (but still is_likely_text_file=false), or other unhandled cases.
-                return None, "Skipped (file type not recognized or not in default inclusion list)"
-
-        # 3. For files that are "likely text" (passed above checks),
-        #    do a final explicit binary content check. This is important for files with
-        #    recognized text extensions that might still contain binary data.
-        if is_binary_file(filepath):
-            return None, "Skipped (binary content detected in recognized text file type)"
+        file_name = os.path.basename(filepath)
 
-        # Try to read with UTF-8, common for code. Fallback if needed.
+        # 1.-2. Check excluded extensions and whether the file type is generally included
+        if check_name:
+            skip_reason = _skip_reason_for_name(file_name, exclude_extensions)
+            if skip_reason is not None:
+                return None, skip_reason
+
+        # 3. Read the file with a single open, checking the leading sample for binary
+        #    content. This is important for extension-less files, and for files with
+        #    recognized text extensions that might still contain binary data.
         try:
-            content = filepath.read_text(encoding="utf-8")
-        except UnicodeDecodeError:
-            try:
-                # Common fallback for files not in UTF-8
-                content = filepath.read_text(encoding="latin-1")
-            except Exception as e_read:
-                return None, f"Error reading file (tried utf-8, latin-1): {e_read}"
+            with open(filepath, "rb") as f:
+                raw_bytes = f.read(BINARY_SNIFF_SIZE)
+                if b'\0' in raw_bytes:
+                    if not _file_suffix(file_name) and file_name not in TEXT_FILENAMES_WITHOUT_EXTENSION:
+                        return None, "Skipped (binary file without extension)"
+                    return None, "Skipped (binary content detected in recognized text file type)"
+                file_stat = None
+                if len(raw_bytes) < BINARY_SNIFF_SIZE:
+                    # The sample is the whole file: skip decoding and tokenizing if there is nothing in it
+                    if not _NON_WHITESPACE_BYTE.search(raw_bytes):
+                        return 0, "Empty or whitespace-only file"
+                    read_in_chunks = False
+                else:
+                    file_stat = os.fstat(f.fileno())
+                    read_in_chunks = not exact and file_stat.st_size > CHUNK_THRESHOLD
+
+                if cache is not None:
+                    cache_path = os.path.abspath(filepath)
+                    cache_key = make_cache_key(
+                        file_stat or os.fstat(f.fileno()), raw_bytes, "chunked" if read_in_chunks else "whole"
+                    )
+                    cached_result = cache.get(cache_path, cache_key)
+                    if cached_result is not None:
+                        return cached_result
+
+                if read_in_chunks:
+                    token_count, status_msg = _process_large_file(f)
+                    if cache is not None:
+                        cache.put(cache_path, cache_key, token_count, status_msg)
+                    return token_count, status_msg
+                if len(raw_bytes) == BINARY_SNIFF_SIZE:
+                    raw_bytes += f.read()
         except FileNotFoundError:
             return None, "Error: File not found during processing."
         except Exception as e_read: # Other read errors
             return None, f"Error reading file: {e_read}"
 
-        if not content.strip(): # Check if content is empty or only whitespace
+        status_msg = None
+        if raw_bytes.isascii():
+            # Most source files are plain ASCII, which is also valid UTF-8 and decodes fastest as ASCII
+            content = raw_bytes.decode("ascii")
+        else:
+            # Try to decode with UTF-8, common for code. Fallback if needed.
+            try:
+                content = raw_bytes.decode("utf-8")
+            except UnicodeDecodeError:
+                # Common fallback for files not in UTF-8; latin-1 can decode any byte sequence
+                content = raw_bytes.decode("latin-1")
+                status_msg = "Processed (decoded as latin-1)"
+        if "\r" in content:
+            # Same universal-newline translation that Path.read_text applied
+            content = content.replace("\r\n", "\n").replace("\r", "\n")
+
+        if not content or content.isspace(): # Check if content is empty or only whitespace, without copying it
             return 0, "Empty or whitespace-only file"
 
         token_count = count_tokens_for_text(content)
-        return token_count, None
+        if cache is not None:
+            cache.put(cache_path, cache_key, token_count, status_msg)
+        return token_count, status_msg
 
     except Exception as e:
         # Catch-all for unexpected issues during file processing
         return None, f"Unexpected error processing file: {e}"
 
 
+def _entry_sort_key(entry: os.DirEntry) -> str:
+    """
+    Sort key of a directory entry, such that sorting a depth-first walk sorts the paths:
+    "a/z.py" sorts after "a-b.py" and "a.py", so the directory "a" sorts as "a/".
+    """
+    return entry.name + os.sep if entry.is_dir(follow_symlinks=False) else entry.name
+
+
+def _iter_files(
+    directory_path: Path, exclude_dirs_set: Set[str], skipped_dirs: List[str]
+) -> Iterator[Tuple[os.DirEntry, Tuple[int, int]]]:
+    """
+    Recursively yields the files under a directory as (os.DirEntry, file_id) pairs.
+
+    The walk is depth-first with each directory's entries sorted by name (a directory's
+    name followed by os.sep), so files come in the order of their path strings, as
+    `process_directory` sorts them. The order is deterministic (it also decides which
+    of several hard links is counted).
+    Entry types come from the directory listing itself, so classifying an entry
+    needs no stat call (except for symlinks, whose target type must be looked up).
+    file_id is the (st_dev, st_ino) pair of the file, which is shared by hard links
+    and by symlinks to the same file. For regular files it is built from the
+    directory's device and the inode number reported by the listing.
+
+    Directories whose name is in exclude_dirs_set (or matches one of its
+    shell-style wildcard entries, e.g. "*.egg-info") are never descended into;
+    their paths (relative to directory_path) are appended to skipped_dirs instead.
+    Symlinked directories are not followed, matching the previous rglob behaviour,
+    and a directory reached twice (e.g. through a bind mount) is only scanned once.
+    """
+    exclude_dir_patterns = [d for d in exclude_dirs_set if any(c in d for c in "*?[")]
+    base_prefix_len = len(os.path.join(str(directory_path), "")) # Entry paths all start with this
+    visited_dirs = set()
+
+    def open_dir(dir_path: str) -> Optional[Tuple[int, Iterator[os.DirEntry]]]:
+        # Returns (st_dev, iterator over sorted entries), or None to skip the directory
+        try:
+            dir_stat = os.stat(dir_path)
+            dir_id = (dir_stat.st_dev, dir_stat.st_ino)
+            if dir_id in visited_dirs:
+                return None
+            visited_dirs.add(dir_id)
+            with os.scandir(dir_path) as it:
+                return dir_stat.st_dev, iter(sorted(it, key=_entry_sort_key))
+        except OSError: # Unreadable directory, skip it like rglob did
+            return None
+
+    root_listing = open_dir(str(directory_path))
+    pending_dirs = [root_listing] if root_listing else []
+    while pending_dirs:
+        dir_dev, entries = pending_dirs[-1]
+        entry = next(entries, None)
+        if entry is None:
+            pending_dirs.pop()
+            continue
+
+        if entry.is_dir(follow_symlinks=False):
+            if entry.name in exclude_dirs_set or any(
+                fnmatch.fnmatchcase(entry.name, pattern) for pattern in exclude_dir_patterns
+            ):
+                skipped_dirs.append(entry.path[base_prefix_len:])
+            else:
+                listing = open_dir(entry.path)
+                if listing:
+                    pending_dirs.append(listing)
+        elif entry.is_file():
+            if entry.is_symlink():
+                target_stat = entry.stat() # Already cached by is_file()
+                file_id = (target_stat.st_dev, target_stat.st_ino)
+            else:
+                file_id = (dir_dev, entry.inode())
+            yield entry, file_id
+
+
+# Syntax that RE2 accepts but matches differently from `re` (or that `re` rejects): the shorthand
+# classes \w, \d, \s and word boundaries \b, which RE2 matches as ASCII only, and the escapes \p, \P,
+# \C, \Q and \z (but not an escaped backslash followed by one of those letters); POSIX classes such
+# as [[:digit:]], which `re` reads as a set of characters; and $, which `re` also matches before a
+# trailing newline.
+_NOT_SAME_IN_RE2 = re.compile(r"(?<!\\)(?:\\\\)*\\[wWdDsSbBpPCQz]|\[\[:|\$")
+
+
+def _compile_file_regex(pattern: str):
+    r"""
+    Compiles the file path pattern, using RE2 when google-re2 is installed.
+    The pattern is always compiled with `re` first, so whether it is valid does not depend
+    on RE2 being installed. RE2 is then only used for patterns it matches exactly as `re`
+    does: patterns it cannot handle (e.g. backreferences or lookarounds) stay with `re`, as
+    do patterns using \w, \d, \s or \b, which RE2 matches as ASCII only where `re` matches
+    Unicode (so `^\w+\.py$` still matches `café.py`), and other syntax listed at `_NOT_SAME_IN_RE2`.
+
+    Raises:
+        re.error: If the pattern is not a valid regular expression.
+    """
+    compiled_regex = re.compile(pattern)
+    if re2 is not None and not _NOT_SAME_IN_RE2.search(pattern):
+        options = re2.Options()
+        options.log_errors = False # Unsupported patterns are expected; don't let RE2 print to stderr
+        try:
+            return re2.compile(pattern, options)
+        except re2.error: # Syntax RE2 does not support
+            pass
+    return compiled_regex
+
+
+def _init_worker_process() -> None:
+    """
+    Initializer for tokenizer worker processes: loads the tokenizer once per process.
+    Load errors are left to surface per file from process_file.
+    """
+    try:
+        init_tokenizer()
+    except RuntimeError:
+        pass
+
+
+class FileResults(Sequence):
+    """
+    Per-file results stored column-wise: one list of paths, one compact integer array of
+    token counts (-1 for files without a count) and one array of indices into a table of
+    distinct status messages. This takes a fraction of the memory of one dictionary per file.
+
+    Behaves as a read-only sequence of the usual {"path": ..., "tokens": ..., "status": ...}
+    dictionaries, built on demand: it can be indexed, sliced (giving a list), compared with
+    a list of such dictionaries, and sorted in place with `sort`. `to_list` converts it to
+    a plain list, e.g. for `json.dumps`.
+    """
+
+    def __init__(self):
+        self.paths = []
+        self.tokens = array("q")
+        self.status_ids = array("I")
+        self.status_table = []
+        self._status_index = {}
+
+    def append(self, file_result: dict) -> None:
+        """
+        Adds one {"path", "tokens", "status"} result.
+        """
+        status = file_result["status"]
+        status_id = self._status_index.get(status)
+        if status_id is None:
+            status_id = self._status_index[status] = len(self.status_table)
+            self.status_table.append(status)
+        self.paths.append(file_result["path"])
+        self.tokens.append(-1 if file_result["tokens"] is None else file_result["tokens"])
+        self.status_ids.append(status_id)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[dict, List[dict]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.paths)))]
+        token_count = self.tokens[index]
+        return {
+            "path": self.paths[index],
+            "tokens": None if token_count < 0 else token_count,
+            "status": self.status_table[self.status_ids[index]]
+        }
+
+    def __iter__(self) -> Iterator[dict]:
+        for index in range(len(self.paths)):
+            yield self[index]
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (FileResults, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None # Mutable, like a list
+
+    def __repr__(self) -> str:
+        return f"FileResults({self.to_list()!r})"
+
+    def to_list(self) -> List[dict]:
+        """
+        Returns the results as a list of dictionaries.
+        """
+        return list(self)
+
+    def order_by_tokens(self) -> List[int]:
+        """
+        Returns the indices of the results sorted by token count (descending), files without
+        a count last, and by path (ascending) for ties.
+        """
+        tokens, paths = self.tokens, self.paths
+        return sorted(range(len(paths)), key=lambda i: (tokens[i] < 0, -tokens[i], paths[i]))
+
+    def sort(self, *, key=None, reverse: bool = False) -> None:
+        """
+        Sorts the results in place, like list.sort on the result dictionaries.
+        """
+        file_results = self.to_list()
+        sort_key = file_results.__getitem__ if key is None else lambda i: key(file_results[i])
+        self._reorder(sorted(range(len(file_results)), key=sort_key, reverse=reverse))
+
+    def sort_by_path(self) -> None:
+        """
+        Reorders the results by path, in place.
+        """
+        self._reorder(sorted(range(len(self.paths)), key=self.paths.__getitem__))
+
+    def _reorder(self, order: List[int]) -> None:
+        self.paths = [self.paths[i] for i in order]
+        self.tokens = array("q", (self.tokens[i] for i in order))
+        self.status_ids = array("I", (self.status_ids[i] for i in order))
+
+
+def _empty_summary() -> dict:
+    """
+    Returns a summary dictionary with all counters at zero.
+    """
+    return {
+        "total_files_processed_successfully": 0,
+        "total_files_with_errors": 0,
+        "total_files_skipped": 0,
+        "total_tokens": 0,
+        "directories_explicitly_skipped": [] # For directories matching names in exclude_dirs_set
+    }
+
+
+def _skipped_file_result(summary: dict, rel_path_str: str, status_msg: str) -> dict:
+    """
+    Builds the result entry for a file skipped before processing, and counts it in the summary.
+    """
+    summary["total_files_skipped"] += 1
+    return {"path": rel_path_str, "tokens": None, "status": status_msg}
+
+
+def _file_result(summary: dict, rel_path_str: str, token_count: Optional[int], status_msg: Optional[str]) -> dict:
+    """
+    Builds the result entry for the outcome of process_file, and counts it in the summary.
+    """
+    if token_count is not None:
+        summary["total_tokens"] += token_count
+        summary["total_files_processed_successfully"] += 1
+        return {
+            "path": rel_path_str,
+            "tokens": token_count,
+            "status": status_msg if status_msg else "Processed"
+        }
+    summary["total_files_with_errors"] +=1 # Or map to skipped based on reason
+                                           # Let's count errors separately from skips
+    return {
+        "path": rel_path_str,
+        "tokens": None,
+        "status": status_msg or "Skipped (Unknown reason)" # Should have a reason from process_file
+    }
+
+
+def iter_directory(
+    directory_path_str: str,
+    file_regex_pattern: str,
+    exclude_dirs: Optional[Set[str]] = None,
+    exclude_extensions: Optional[Set[str]] = None,
+    max_workers: Optional[int] = None,
+    use_processes: bool = False,
+    exact: bool = False,
+    use_cache: bool = False
+) -> Iterator[dict]:
+    """
+    Scans a directory like `process_directory`, but yields results as they become
+    available instead of collecting them, so memory use does not grow with the
+    number of files. Arguments are the same as for `process_directory`.
+
+    Yields:
+        One {"path": ..., "tokens": ..., "status": ...} dictionary per file, in traversal
+        order (which sorts the paths, see `_iter_files`), followed by a single final
+        {"summary": ..., "errors": [...]} dictionary laid out like the corresponding
+        `process_directory` keys. If the arguments are invalid, only the final
+        dictionary is yielded, with the problem described in "errors".
+    """
+    summary = _empty_summary()
+
+    directory_path = Path(directory_path_str).resolve()
+    if not directory_path.is_dir():
+        yield {
+            "summary": summary,
+            "errors": [f"Error: Path '{directory_path_str}' is not a valid directory or not accessible."]
+        }
+        return
+
+    try:
+        compiled_regex = _compile_file_regex(file_regex_pattern)
+    except re.error as e:
+        yield {
+            "summary": summary,
+            "errors": [f"Error: Invalid regex pattern '{file_regex_pattern}': {e}"]
+        }
+        return
+
+    if exclude_dirs is None:
+        exclude_dirs_set = DEFAULT_EXCLUDE_DIRS
+    else:
+        exclude_dirs_set = frozenset(exclude_dirs) # Assumes exclude_dirs is already a set of strings
+
+    # Normalize exclude_extensions once, ensuring leading dot and lowercase
+    current_exclude_extensions_set = frozenset(
+        ext if ext.startswith('.') else '.' + ext
+        for ext in (e.lower().strip() for e in exclude_extensions or ())
+    )
+
+    # Reading, binary-sniffing and tokenizing are independent per file, so run them concurrently.
+    if max_workers is None:
+        max_workers = DEFAULT_MAX_WORKERS
+    if use_processes:
+        max_workers = min(max_workers, os.cpu_count() or 1)
+    # Results are yielded in traversal order; this bounds how many may be waiting behind a slow file
+    max_pending = max_workers * 4
+
+    # The cache lives in this process, so worker processes cannot share it
+    cache = TokenCountCache() if use_cache and not use_processes else None
+
+    def make_executor() -> Executor:
+        if use_processes:
+            # Workers read the files themselves, so only paths and counts cross the process boundary
+            return ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker_process)
+        return ThreadPoolExecutor(max_workers=max_workers)
+
+    # The walk below already checked each file name with _skip_reason_for_name, so process_file does not
+    def submit(file_path: str) -> Future:
+        return executor.submit(process_file, file_path, current_exclude_extensions_set, exact, cache, check_name=False)
+
+    def finish(rel_path_str: str, work) -> dict:
+        # work is a ready result entry, a Future from the executor, or a file path not yet processed
+        if isinstance(work, dict):
+            return work
+        if isinstance(work, Future):
+            return _file_result(summary, rel_path_str, *work.result())
+        return _file_result(summary, rel_path_str, *process_file(
+            work, current_exclude_extensions_set, exact, cache, check_name=False
+        ))
+
+    def is_ready(work) -> bool:
+        return isinstance(work, dict) or (isinstance(work, Future) and work.done())
+
+    # (rel_path_str, work) pairs, in traversal order. Until more than PARALLEL_MIN_FILES files
+    # need processing, no executor is started and their paths are simply held here.
+    pending = deque()
+    executor = None
+    files_to_process = 0
+    regex_search = compiled_regex.search
+    # Entry paths are built by joining onto this prefix, so slicing it off gives the relative path
+    base_prefix_len = len(os.path.join(str(directory_path), ""))
+    seen_file_ids = set() # (st_dev, st_ino) of files already queued, so hard links are counted once
+    try:
+        # Excluded directories are pruned during traversal, so files beneath them are never visited.
+        for entry, file_id in _iter_files(directory_path, exclude_dirs_set, summary["directories_explicitly_skipped"]):
+            rel_path_str = entry.path[base_prefix_len:]
+
+            # First, check if the file path matches the provided regex
+            if not regex_search(rel_path_str):
+                pending.append((rel_path_str, _skipped_file_result(
+                    summary, rel_path_str, f"Skipped (did not match regex: '{file_regex_pattern}')"
+                )))
+            # Name-based skips are decided per link, before deduplicating, so a skipped link
+            # (e.g. `a.bak`) does not hide another link to the same file (e.g. `b.py`)
+            elif (skip_reason := _skip_reason_for_name(entry.name, current_exclude_extensions_set)) is not None:
+                pending.append((rel_path_str, _file_result(summary, rel_path_str, None, skip_reason)))
+            elif file_id in seen_file_ids:
+                pending.append((rel_path_str, _skipped_file_result(
+                    summary, rel_path_str, "Skipped (hard link or symlink to a file already counted)"
+                )))
+            else:
+                seen_file_ids.add(file_id)
+                files_to_process += 1
+                if executor is None and max_workers > 1 and files_to_process > PARALLEL_MIN_FILES:
+                    executor = make_executor()
+                    pending = deque(
+                        (held_rel_path, submit(work) if isinstance(work, str) else work)
+                        for held_rel_path, work in pending
+                    )
+                if executor is not None:
+                    pending.append((rel_path_str, submit(entry.path)))
+                else:
+                    pending.append((rel_path_str, entry.path))
+
+            while pending and (len(pending) > max_pending or is_ready(pending[0][1])):
+                yield finish(*pending.popleft())
+
+        while pending:
+            yield finish(*pending.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True) # Only has work left to cancel if the caller stopped early
+        if cache is not None:
+            cache.save()
+            cache.close()
+
+    summary["directories_explicitly_skipped"] = sorted(set(summary["directories_explicitly_skipped"]))
+    yield {"summary": summary, "errors": []}
+
+
 def process_directory(
     directory_path_str: str,
     file_regex_pattern: str,
     exclude_dirs: Optional[Set[str]] = None,
-    exclude_extensions: Optional[Set[str]] = None
+    exclude_extensions: Optional[Set[str]] = None,
+    max_workers: Optional[int] = None,
+    use_processes: bool = False,
+    exact: bool = False,
+    use_cache: bool = False
 ) -> dict:
     """
     Scans a directory, counts tokens for each valid file matching the regex, and returns a summary.
+    This collects the output of `iter_directory` into a single dictionary.
 
     Args:
         directory_path_str: The path to the directory to scan.
         file_regex_pattern: The regex pattern to match file paths against.
-        exclude_dirs: A set of directory names to exclude. Defaults to DEFAULT_EXCLUDE_DIRS.
+        exclude_dirs: A set of directory names (or shell-style wildcards) to exclude. Defaults to DEFAULT_EXCLUDE_DIRS.
         exclude_extensions: A set of file extensions (e.g., {".log", ".tmp"}) to exclude.
+        max_workers: Number of files read and tokenized concurrently, i.e. how many reads
+            are kept in flight. Defaults to DEFAULT_MAX_WORKERS; 1 processes files serially.
+        use_processes: Read and tokenize files in worker processes instead of threads, so
+            tokenization is not serialized by the GIL. The worker count is capped at the CPU count.
+        exact: Read files larger than CHUNK_THRESHOLD whole instead of streaming them.
+        use_cache: Reuse token counts of unchanged files from previous runs, and store new ones
+            (see `cache.TokenCountCache`). Not used together with use_processes.
 
     Returns:
         A dictionary containing:
         {
-            "files": [
+            "files": FileResults, a sequence of [
                 {"path": "rel_path_to_file", "tokens": count, "status": "Processed"},
                 {"path": "rel_path_to_file", "tokens": null, "status": "Error message or Skipped"},
                 ...
@@ -174,260 +743,20 @@ def process_directory(
             },
             "errors": list_of_general_errors (e.g., if input directory is invalid)
         }
+        Use results["files"].to_list() for a plain list, e.g. to serialize it with json.
     """
-    directory_path = Path(directory_path_str).resolve()
-    if not directory_path.is_dir():
-        return {
-            "files": [],
-            "summary": {
-                "total_files_processed_successfully": 0,
-                "total_files_with_errors": 0,
-                "total_files_skipped": 0,
-                "total_tokens": 0,
-                "directories_explicitly_skipped": []
-            },
-            "errors": [f"Error: Path '{directory_path_str}' is not a valid directory or not accessible."]
-        }
-
-    try:
-        compiled_regex = re.compile(file_regex_pattern)
-    except re.error as e:
-        return {
-            "files": [],
-            "summary": {
-                "total_files_processed_successfully": 0,
-                "total_files_with_errors": 0,
-                "total_files_skipped": 0,
-                "total_tokens": 0,
-                "directories_explicitly_skipped": []
-            },
-            "errors": [f"Error: Invalid regex pattern '{file_regex_pattern}': {e}"]
-        }
-
-    if exclude_dirs is None:
-        exclude_dirs_set = DEFAULT_EXCLUDE_DIRS
-    else:
-        exclude_dirs_set = set(exclude_dirs) # Assumes exclude_dirs is already a set of strings
-
-    # Prepare exclude_extensions set, ensuring leading dot and lowercase
-    current_exclude_extensions_set = set()
-    if exclude_extensions:
-        for ext in exclude_extensions:
-            cleaned_ext = ext.lower().strip()
-            if not cleaned_ext.startswith('.'):
-                cleaned_ext = '.' + cleaned_ext
-            current_exclude_extensions_set.add(cleaned_ext)
-
-    results = {
-        "files": [],
-        "summary": {
-            "total_files_processed_successfully": 0,
-            "total_files_with_errors": 0,
-            "total_files_skipped": 0,
-            "total_tokens": 0,
-            "directories_explicitly_skipped": [] # For directories matching names in exclude_dirs_set
-        },
-        "errors": []
-    }
-
-    processed_paths = set() # To avoid double processing if symlinks loop, though rglob might handle some of this
-
-    for item_path in directory_path.rglob("*"):
-        if item_path in processed_paths:
-            continue
-        processed_paths.add(item_path)
-
-        rel_path_str = str(item_path.relative_to(directory_path))
-
-        # Check if the item itself or any of its parent directories (up to the root_dir) are in exclude_dirs_set
-        is_in_excluded_dir = False
-        # Check current item if it's a directory and in exclude_dirs_set
-        if item_path.is_dir() and item_path.name in exclude_dirs_set:
-            if rel_path_str not in results["summary"]["directories_explicitly_skipped"]:
-                 results["summary"]["directories_explicitly_skipped"].append(rel_path_str)
-            # Do not descend further into this directory by virtue of how rglob works if we could prune.
-            # With rglob, we simply skip files found within it later.
-            # For now, we just mark the directory and files within will be skipped.
-            is_in_excluded_dir = True
-
-
-        # Check parents
-        current_check_path = item_path.parent
-        while current_check_path != directory_path and current_check_path != current_check_path.parent : # Stop before root_dir or filesystem root
-            if current_check_path.name in exclude_dirs_set:
-                is_in_excluded_dir = True
-                # Add the top-most excluded directory found in the path to the list
-                # This logic is a bit tricky with rglob as we get all paths.
-                # A simpler approach is to check each file's path parts.
-                break
-            current_check_path = current_check_path.parent
-        
-        # Simpler check for file's path parts
-        path_parts = set(item_path.relative_to(directory_path).parts)
-        if any(part in exclude_dirs_set for part in path_parts):
-            is_in_excluded_dir = True
-
-
-        if item_path.is_file():
-            # First, check if the file path matches the provided regex
-            if not compiled_regex.search(rel_path_str):
-                results["summary"]["total_files_skipped"] += 1
-                results["files"].append({
-                    "path": rel_path_str,
-                    "tokens": None,
-                    "status": f"Skipped (did not match regex: '{file_regex_pattern}')"
-                })
-                continue
-
-            if is_in_excluded_dir:
-                results["summary"]["total_files_skipped"] += 1
-                # Find which excluded dir caused this
-                offending_dir_part = "unknown"
-                for part in item_path.relative_to(directory_path).parts:
-                    if part in exclude_dirs_set:
-                        offending_dir_part = part
-                        break
-                results["files"].append({
-                    "path": rel_path_str,
-                    "tokens": None,
-                    "status": f"Skipped (in or under excluded directory '{offending_dir_part}')"
-                })
-                continue
-
-            # Basic progress indication, can be made optional
-            # print(f"Processing: {rel_path_str}...")
-
-            token_count, status_msg = process_file(item_path, current_exclude_extensions_set)
-
-            if token_count is not None:
-                results["files"].append({
-                    "path": rel_path_str,
-                    "tokens": token_count,
-                    "status": status_msg if status_msg else "Processed"
-                })
-                results["summary"]["total_tokens"] += token_count
-                results["summary"]["total_files_processed_successfully"] += 1
-            else:
-                results["files"].append({
-                    "path": rel_path_str,
-                    "tokens": None,
-                    "status": status_msg or "Skipped (Unknown reason)" # Should have a reason from process_file
-                })
-                results["summary"]["total_files_with_errors"] +=1 # Or map to skipped based on reason
-                                                                 # Let's count errors separately from skips
-        elif item_path.is_dir() and item_path.name in exclude_dirs_set and rel_path_str not in results["summary"]["directories_explicitly_skipped"]:
-            # This ensures directories directly named in exclude_dirs_set are listed even if empty.
-            results["summary"]["directories_explicitly_skipped"].append(rel_path_str)
-
+    results = {"files": FileResults()}
+    for item in iter_directory(
+        directory_path_str, file_regex_pattern, exclude_dirs, exclude_extensions, max_workers, use_processes, exact,
+        use_cache
+    ):
+        if "summary" in item:
+            results["summary"] = item["summary"]
+            results["errors"] = item["errors"]
+        else:
+            results["files"].append(item)
 
     # Sort files by path for consistent output
-    results["files"].sort(key=lambda x: x["path"])
-    results["summary"]["directories_explicitly_skipped"] = sorted(list(set(results["summary"]["directories_explicitly_skipped"])))
-
+    results["files"].sort_by_path()
 
     return results
-
-if __name__ == '__main__':
-    # Example usage for testing this module directly
-    print("Testing calculator module...")
-    from tempfile import TemporaryDirectory
-    
-    with TemporaryDirectory() as tmpdir:
-        tmpdir_path = Path(tmpdir)
-        (tmpdir_path / "file1.py").write_text("def hello():\n  print('world') # Python comment")
-        (tmpdir_path / "file2.txt").write_text("This is some text with numbers 123 and symbols !@#.")
-        (tmpdir_path / "binary_file.bin").write_bytes(b"binary\0content\0nulls")
-        (tmpdir_path / "empty_file.py").write_text("")
-        (tmpdir_path / "whitespace_file.js").write_text("   \n\t  \n ")
-        (tmpdir_path / "Dockerfile").write_text("FROM python:3.9-slim\nWORKDIR /app")
-        (tmpdir_path / "file_to_exclude.log").write_text("This is a log file and should be excluded.")
-        (tmpdir_path / "another_to_exclude.tmp").write_text("Temporary data.")
-        (tmpdir_path / "document.Py").write_text("# Case test for exclusion")
-
-        
-        sub_dir = tmpdir_path / "subdir"
-        sub_dir.mkdir()
-        (sub_dir / "file3.js").write_text("console.log('test from subdir'); // JS comment")
-        
-        excluded_dir_git = tmpdir_path / ".git"
-        excluded_dir_git.mkdir()
-        (excluded_dir_git / "config").write_text("some git config data")
-        (excluded_dir_git / "HEAD").write_text("ref: refs/heads/main")
-
-        excluded_dir_node = tmpdir_path / "node_modules"
-        excluded_dir_node.mkdir()
-        (excluded_dir_node / "some_package.js").write_text("var x = 1;")
-
-
-        print(f"\nProcessing test directory: {tmpdir_path} (with regex and extension exclusions)\n")
-        data = process_directory(
-            str(tmpdir_path),
-            file_regex_pattern=r".*(\.(py|txt|js)$|Dockerfile|Makefile)", # Test regex
-            exclude_extensions={"\.log", "\.tmp", "\.Py"} # Test case-insensitivity and leading dot
-        )
-
-        print("\n--- Results ---")
-        for f_data in data["files"]:
-            print(f"File: {f_data['path']}, Tokens: {f_data['tokens']}, Status: {f_data['status']}")
-        
-        print("\n--- Summary ---")
-        print(f"Total files processed successfully: {data['summary']['total_files_processed_successfully']}")
-        print(f"Total files with errors: {data['summary']['total_files_with_errors']}")
-        print(f"Total files skipped (binary, excluded dir, etc.): {data['summary']['total_files_skipped']}")
-        print(f"Total tokens: {data['summary']['total_tokens']}")
-        if data['summary']['directories_explicitly_skipped']:
-            print(f"Directories explicitly skipped (name matched exclude list): {data['summary']['directories_explicitly_skipped']}")
-        if data["errors"]:
-            print("\n--- General Errors ---")
-            for err in data["errors"]:
-                print(err)
-
-        # Test with a non-existent directory
-        print("\n--- Testing non-existent directory ---")
-        non_existent_data = process_directory("a_s_d_f_path_does_not_exist_z_x_c_v", r".*") # Provide a dummy regex
-        if non_existent_data["errors"]:
-            print(f"Error for non-existent dir: {non_existent_data['errors'][0]}")
-            assert "not a valid directory" in non_existent_data['errors'][0]
-        else:
-            print("Test failed: No error for non-existent directory.")
-
-        # Test with an invalid regex
-        print("\n--- Testing invalid regex ---")
-        invalid_regex_data = process_directory(str(tmpdir_path), file_regex_pattern="*invalid[")
-        if invalid_regex_data["errors"]:
-            print(f"Error for invalid regex: {invalid_regex_data['errors'][0]}")
-            assert "Invalid regex pattern" in invalid_regex_data['errors'][0]
-        else:
-            print("Test failed: No error for invalid regex.")
-        
-        print("\nCalculator module test completed.")
-        # Test with an invalid regex
-        print("\n--- Testing invalid regex ---")
-        invalid_regex_data = process_directory(str(tmpdir_path), file_regex_pattern="*invalid[")
-        if invalid_regex_data["errors"]:
-            print(f"Error for invalid regex: {invalid_regex_data['errors'][0]}")
-            assert "Invalid regex pattern" in invalid_regex_data['errors'][0]
-        else:
-            print("Test failed: No error for invalid regex.")
-        
-        print("\nCalculator module test completed.")
-        # Test with an invalid regex
-        print("\n--- Testing invalid regex ---")
-        invalid_regex_data = process_directory(str(tmpdir_path), file_regex_pattern="*invalid[")
-        if invalid_regex_data["errors"]:
-            print(f"Error for invalid regex: {invalid_regex_data['errors'][0]}")
-            assert "Invalid regex pattern" in invalid_regex_data['errors'][0]
-        else:
-            print("Test failed: No error for invalid regex.")
-        
-        print("\nCalculator module test completed.")
-        # Test with an invalid regex
-        print("\n--- Testing invalid regex ---")
-        invalid_regex_data = process_directory(str(tmpdir_path), file_regex_pattern="*invalid[")
-        if invalid_regex_data["errors"]:
-            print(f"Error for invalid regex: {invalid_regex_data['errors'][0]}")
-            assert "Invalid regex pattern" in invalid_regex_data['errors'][0]
-        else:
-            print("Test failed: No error for invalid regex.")
-        
-        print("\nCalculator module test completed.")
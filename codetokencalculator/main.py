@@ -5,87 +5,117 @@ Command-line interface for the Code Token Calculator.
 """
 
 import argparse
+import itertools
 import json
 from pathlib import Path
 import sys
 from datetime import datetime
+from typing import Iterable, Iterator
 
-from .calculator import process_directory, DEFAULT_EXCLUDE_DIRS, DEFAULT_INCLUDE_EXTENSIONS, TEXT_FILENAMES_WITHOUT_EXTENSION
+from .calculator import iter_directory, FileResults, DEFAULT_EXCLUDE_DIRS, DEFAULT_INCLUDE_EXTENSIONS, DEFAULT_MAX_WORKERS, TEXT_FILENAMES_WITHOUT_EXTENSION
+from .tokenizer import get_encoding_name, CLAUDE_ENCODING_MODEL, ENCODING_ENV_VAR
 from . import __version__
 
-def format_results_text(data: dict, directory_path_str: str, sort_by_tokens: bool, show_skipped_files: bool) -> str:
+def iter_report_lines(
+    results: Iterable[dict], directory_path_str: str, sort_by_tokens: bool, show_skipped_files: bool
+) -> Iterator[str]:
     """
-    Formats the token count results into a human-readable text block.
+    Formats token count results into human-readable report lines, as they arrive.
+
+    `results` is a stream as produced by `iter_directory`: per-file dictionaries followed by
+    a final dictionary with "summary" and "errors". File lines are emitted as soon as each file
+    result is available, except when sorting by tokens, which needs all results first.
     """
-    output_lines = []
     base_path = Path(directory_path_str).resolve()
 
-    output_lines.append(f"Code Token Calculator Report - v{__version__}")
-    output_lines.append(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    output_lines.append(f"Target Directory: {base_path}")
-    output_lines.append("-" * 80)
-
-    if data["errors"]:
-        output_lines.append("ERRORS ENCOUNTERED:")
-        for err in data["errors"]:
-            output_lines.append(f"- {err}")
-        output_lines.append("-" * 80)
-        return "\n".join(output_lines)
-
-    output_lines.append("\nFile Token Counts:")
-    if not show_skipped_files and any(f["tokens"] is None for f in data["files"]):
-        output_lines.append("(Skipped/errored files are hidden from this list. Use --show-skipped to display them.)")
+    yield f"Code Token Calculator Report - v{__version__}"
+    yield f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    yield f"Target Directory: {base_path}"
+    yield "-" * 80
+
+    results = iter(results)
+    first_item = next(results)
+    if first_item.get("errors"):
+        yield "ERRORS ENCOUNTERED:"
+        for err in first_item["errors"]:
+            yield f"- {err}"
+        yield "-" * 80
+        return
+
+    yield "\nFile Token Counts:"
     header = f"{'Path':<60} | {'Tokens':>10} | Status"
-    output_lines.append(header)
-    output_lines.append("-" * len(header))
+    yield header
+    yield "-" * len(header)
 
     max_path_len = 60 # Default, adjust if needed based on actual paths
 
-    files_to_display = data["files"]
-    if sort_by_tokens:
-        # Sort by tokens (descending), then by path (ascending) for tie-breaking
-        # Handle None tokens by placing them at the end (or treating as -1 for sorting purposes)
-        files_to_display = sorted(
-            files_to_display,
-            key=lambda x: (x["tokens"] is None, - (x["tokens"] or 0), x["path"])
-        )
-        output_lines.append("Sorted by token count (descending).")
-        output_lines.append("---")
+    final_item = None
+    files_hidden = False
 
+    def iter_file_results():
+        nonlocal final_item
+        for item in itertools.chain((first_item,), results):
+            if "summary" in item:
+                final_item = item
+            else:
+                yield item
 
+    files_to_display = iter_file_results()
+    if sort_by_tokens:
+        # Sort by tokens (descending), then by path (ascending) for tie-breaking, with
+        # None tokens at the end. Results are collected column-wise to keep memory low.
+        collected = FileResults()
+        for file_info in files_to_display:
+            collected.append(file_info)
+        files_to_display = (collected[i] for i in collected.order_by_tokens())
+        yield "Sorted by token count (descending)."
+        yield "---"
+
+
+    # Bound once rather than parsing an f-string per line; this loop runs once per file
+    format_line = f"{{:<{max_path_len}}} | {{:>10}} | {{}}".format
+    truncate_above = max_path_len - 3 # -3 for "..."
     for file_info in files_to_display:
-        if not show_skipped_files and file_info["tokens"] is None:
-            continue # Do not list skipped/errored files if not requested
-
-        path_str = file_info["path"]
-        tokens_str = str(file_info["tokens"]) if file_info["tokens"] is not None else "N/A"
-        status_str = file_info["status"]
+        tokens = file_info["tokens"]
+        if tokens is None:
+            if not show_skipped_files:
+                files_hidden = True
+                continue # Do not list skipped/errored files if not requested
+            tokens = "N/A"
 
         # Truncate long paths for display
-        if len(path_str) > max_path_len -3: # -3 for "..."
-             display_path = "..." + path_str[-(max_path_len-3):]
-        else:
-            display_path = path_str
+        path_str = file_info["path"]
+        if len(path_str) > truncate_above:
+            path_str = "..." + path_str[-truncate_above:]
 
-        output_lines.append(f"{display_path:<{max_path_len}} | {tokens_str:>10} | {status_str}")
+        yield format_line(path_str, tokens, file_info["status"])
 
-    output_lines.append("-" * len(header))
-    output_lines.append("\nSummary:")
-    output_lines.append("-" * 80)
+    yield "-" * len(header)
+    if files_hidden:
+        yield "(Skipped/errored files are hidden from this list. Use --show-skipped to display them.)"
+    yield "\nSummary:"
+    yield "-" * 80
 
-    summary = data["summary"]
-    output_lines.append(f"Total files processed successfully: {summary['total_files_processed_successfully']:>10}")
-    output_lines.append(f"Total files with errors:          {summary['total_files_with_errors']:>10}")
-    output_lines.append(f"Total files skipped:              {summary['total_files_skipped']:>10}")
-    output_lines.append(f"Total tokens counted:             {summary['total_tokens']:>10}")
+    summary = final_item["summary"]
+    yield f"Total files processed successfully: {summary['total_files_processed_successfully']:>10}"
+    yield f"Total files with errors:          {summary['total_files_with_errors']:>10}"
+    yield f"Total files skipped:              {summary['total_files_skipped']:>10}"
+    yield f"Total tokens counted:             {summary['total_tokens']:>10}"
 
     if summary['directories_explicitly_skipped']:
-        output_lines.append("\nDirectories explicitly skipped (due to name matching exclude list):")
+        yield "\nDirectories explicitly skipped (due to name matching exclude list):"
         for skipped_dir in summary['directories_explicitly_skipped']:
-            output_lines.append(f"- {skipped_dir}")
+            yield f"- {skipped_dir}"
+
+    yield "-" * 80
 
-    output_lines.append("-" * 80)
-    return "\n".join(output_lines)
+
+def format_results_text(data: dict, directory_path_str: str, sort_by_tokens: bool, show_skipped_files: bool) -> str:
+    """
+    Formats the token count results returned by `process_directory` into a human-readable text block.
+    """
+    results = itertools.chain(data["files"], ({"summary": data["summary"], "errors": data["errors"]},))
+    return "\n".join(iter_report_lines(results, directory_path_str, sort_by_tokens, show_skipped_files))
 
 
 def main_cli():
@@ -148,10 +178,46 @@ def main_cli():
         "--exclude-dirs",
         type=str,
         help=(
-            "Comma-separated list of directory names to exclude.\n"
+            "Comma-separated list of directory names to exclude. Shell-style wildcards\n"
+            "(e.g., *.egg-info) are supported.\n"
             f"Defaults: {','.join(sorted(list(DEFAULT_EXCLUDE_DIRS)))}"
         )
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help=(
+            "Number of files read and tokenized concurrently (default: %(default)s).\n"
+            "Raise it on fast SSD/NVMe storage to keep more reads in flight; 1 disables parallelism."
+        )
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help=(
+            "Read and tokenize files in worker processes instead of threads, so tokenization\n"
+            "scales across CPU cores. The number of workers is capped at the CPU count."
+        )
+    )
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help=(
+            "Read large files (over 4 MiB) whole instead of streaming them in pieces to bound memory\n"
+            "use. Streamed counts are exact, except for files with no unindented line that does not\n"
+            "start with '/' in 16 MiB."
+        )
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=(
+            "Do not reuse or store token counts in the cache of previous runs\n"
+            "(~/.cache/codetokencalculator). The cache is not used with --processes."
+        )
+    )
     # TODO: Implement --include-extensions and --exclude-extensions if needed
     # parser.add_argument(
     #     "--include-extensions",
@@ -171,6 +237,8 @@ def main_cli():
     )
 
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
 
     file_regex_pattern = args.file_regex_pattern
     target_directory = args.directory
@@ -189,7 +257,11 @@ def main_cli():
                 exclude_extensions_set.add(cleaned_ext)
 
     print(f"Starting token count for directory: {Path(target_directory).resolve()}")
-    print(f"Using tokenizer: cl100k_base (Claude-compatible)")
+    encoding_name = get_encoding_name()
+    if encoding_name == CLAUDE_ENCODING_MODEL:
+        print(f"Using tokenizer: {encoding_name} (Claude-compatible)")
+    else:
+        print(f"Using tokenizer: {encoding_name} (set by {ENCODING_ENV_VAR})")
     if exclude_dirs_set:
         print(f"Excluding directories named: {', '.join(sorted(list(exclude_dirs_set)))}")
     if exclude_extensions_set:
@@ -200,33 +272,42 @@ def main_cli():
         print("Note: Skipped/errored files are hidden from the detailed list by default (use --show-skipped to display).")
     print("Processing...")
 
-    try:
-        results_data = process_directory(
-            directory_path_str=target_directory,
-            file_regex_pattern=file_regex_pattern,
-            exclude_dirs=exclude_dirs_set,
-            exclude_extensions=exclude_extensions_set
-        )
-    except Exception as e:
-        print(f"\nAn unexpected error occurred during processing: {e}", file=sys.stderr)
-        sys.exit(1)
-
-    report_text = format_results_text(results_data, target_directory, args.sort_by_tokens, args.show_skipped)
-
-    print("\n" + report_text)
+    results_stream = iter_directory(
+        directory_path_str=target_directory,
+        file_regex_pattern=file_regex_pattern,
+        exclude_dirs=exclude_dirs_set,
+        exclude_extensions=exclude_extensions_set,
+        max_workers=args.jobs,
+        use_processes=args.processes,
+        exact=args.exact,
+        use_cache=not args.no_cache
+    )
 
+    # The report is written line by line as results arrive, so it is never held in memory as a whole.
+    output_file = None
+    output_file_path = None
     if args.output_file:
         output_file_path = Path(args.output_file)
         try:
-            output_file_path.write_text(report_text, encoding="utf-8")
-            print(f"\nReport also saved to: {output_file_path.resolve()}")
+            output_file = output_file_path.open("w", encoding="utf-8")
         except IOError as e:
             print(f"\nError saving report to file '{output_file_path}': {e}", file=sys.stderr)
 
-    if results_data["errors"] or results_data["summary"]["total_files_with_errors"] > 0 :
-        # Indicate an issue in exit code if there were processing errors
-        # sys.exit(1) # User might still want to see partial results
-        pass
+    print()
+    try:
+        for line in iter_report_lines(results_stream, target_directory, args.sort_by_tokens, args.show_skipped):
+            print(line)
+            if output_file is not None:
+                output_file.write(line + "\n")
+    except Exception as e:
+        print(f"\nAn unexpected error occurred during processing: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if output_file is not None:
+            output_file.close()
+
+    if output_file is not None:
+        print(f"\nReport also saved to: {output_file_path.resolve()}")
 
 
 if __name__ == "__main__":
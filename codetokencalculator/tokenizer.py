@@ -3,58 +3,477 @@
 """
 Handles the tokenization of text content using tiktoken,
 specifically configured for Anthropic Claude models.
+
+The encoding can be changed with the CTC_ENCODING environment variable, set to an
+encoding name (e.g. o200k_base) or a model name listed in MODEL_TO_ENCODING.
 """
 
+import functools
+import itertools
+import os
+import re
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Optional, TextIO, Union
+
 import tiktoken
 
+try:
+    # Optional faster drop-in replacement for tiktoken, with the same get_encoding API (pip install .[fast])
+    import riptoken as _encoding_backend
+except ImportError:
+    _encoding_backend = tiktoken
+
 # The encoding used by Claude models like Claude 2, Claude 2.1, Claude Instant, Claude 3 Opus, Sonnet, Haiku
 # See: https://github.com/anthropics/anthropic-tokenizer-python (points to tiktoken)
 # And: https://platform.openai.com/docs/guides/embeddings/how-can-i-tell-how-many-tokens-a-string-has
 # The cl100k_base encoding is used by gpt-4, gpt-3.5-turbo, text-embedding-ada-002, and also Claude models.
 CLAUDE_ENCODING_MODEL = "cl100k_base"
 
-# Global tokenizer instance to avoid reloading it repeatedly
-_tokenizer = None
+# Environment variable selecting the encoding, by encoding name or by a model name from MODEL_TO_ENCODING
+ENCODING_ENV_VAR = "CTC_ENCODING"
+
+# Encodings of models that can be given instead of an encoding name
+MODEL_TO_ENCODING = {
+    "claude": "cl100k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-3.5-turbo": "cl100k_base",
+    "gpt-4o": "o200k_base",
+    "gpt-4.1": "o200k_base",
+    "o1": "o200k_base",
+    "o3": "o200k_base",
+}
+
+# Counts of texts up to this many characters are memoised, since repositories often contain
+# identical small files (license headers, empty-ish __init__.py files, generated stubs)
+MEMO_MAX_TEXT_LENGTH = 16 * 1024
+MEMO_MAX_ENTRIES = 4096
+
+# Texts longer than this are split into pieces of about SPLIT_TARGET_LENGTH characters,
+# which are tokenized in parallel
+SPLIT_MIN_TEXT_LENGTH = 256 * 1024
+SPLIT_TARGET_LENGTH = 64 * 1024
+# A line break followed by a non-whitespace character other than "/", possibly after indentation
+# (whitespace other than line breaks). Neither the cl100k_base nor the o200k_base pre-tokenizer joins
+# the text on either side of such a point into one piece, so splitting there keeps counts exact.
+# "/" is excluded because o200k_base joins punctuation with following line breaks and slashes
+# (e.g. ";\n//" is one piece).
+_SAFE_SPLIT_POINT = re.compile(r"\n(?!/)(?=[^\S\r\n]*\S)")
+
+# Token counts of text segments (text up to a safe split point) are remembered for the rest
+# of the process, since many lines recur across the files of a repository (imports, license
+# headers, closing brackets). Only segments up to this many characters are kept. Once
+# SEGMENT_CACHE_MAX_ENTRIES are held, the cache is emptied and starts over, which bounds
+# its memory (per process) to a few MiB.
+SEGMENT_MAX_LENGTH = 512
+SEGMENT_CACHE_MAX_ENTRIES = 64 * 1024
+
+# Number of characters read at a time when streaming a file
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Number of streamed pieces handed to the tokenizer together, to be encoded in parallel
+STREAM_BATCH_SIZE = 8
+# Streamed pieces are cut at the last line break once they grow this long without a safe split point
+STREAM_MAX_PIECE_LENGTH = 16 * STREAM_CHUNK_SIZE
+
+# Number of files handed to a worker at a time by `count_tokens_for_paths`, to amortise
+# inter-process communication
+PATHS_CHUNK_SIZE = 64
+
+# Texts longer than this are counted from tiktoken's buffer of token ids (when available)
+# rather than from a list of Python ints, which saves allocating an object per token
+BUFFER_MIN_TEXT_LENGTH = 4096
+_NO_SPECIAL_TOKENS = frozenset()
+# Text the buffer encoder is checked against encode_ordinary with before it is used
+_BUFFER_CHECK_TEXT = "def f(x):\n    return x + 1  # <|endoftext|> café 123\n"
+
+# The encoding used when none is given, read from the environment once at import
+_default_encoding_name = os.environ.get(ENCODING_ENV_VAR) or CLAUDE_ENCODING_MODEL
+_default_encoding_name = MODEL_TO_ENCODING.get(_default_encoding_name, _default_encoding_name)
 
-def _get_tokenizer():
+def get_encoding_name(encoding_name: Optional[str] = None) -> str:
     """
-    Initializes and returns the tiktoken tokenizer for Claude models.
+    Returns the name of the encoding to use: `encoding_name` if given, otherwise the
+    value of the CTC_ENCODING environment variable at import, otherwise CLAUDE_ENCODING_MODEL.
+    Model names listed in MODEL_TO_ENCODING are translated to their encoding.
+    """
+    if encoding_name is None:
+        return _default_encoding_name
+    return MODEL_TO_ENCODING.get(encoding_name, encoding_name)
+
+# Global tokenizer instances, by encoding name, to avoid reloading them repeatedly.
+# The configured encoding is loaded at import, so the first file counted does not pay the loading cost.
+# A failure here is not raised: `_get_tokenizer` retries the load and reports the error when it is first needed.
+_tokenizers = {}
+# encode_ordinary of the default tokenizer, bound once it is loaded so the counting hot path
+# skips the tokenizer lookup (None while not loaded, or if the backend counts with `count`)
+_encode_ordinary = None
+# The default tokenizer's encoder returning a buffer of token ids. This is a private tiktoken
+# API (used by Encoding.encode_to_numpy), so it is only used if present and if it counts
+# `_BUFFER_CHECK_TEXT` like encode_ordinary does.
+_encode_to_buffer = None
+
+def _count_tokens_in_buffer(encode_to_buffer, text_content: str) -> int:
+    """
+    Counts the tokens of a text with a tokenizer's encoder returning a buffer of token ids.
+    With no special tokens allowed, special-token markers are encoded as plain text.
+    """
+    return memoryview(encode_to_buffer(text_content, _NO_SPECIAL_TOKENS)).nbytes // 4 # uint32 ids
+
+def _set_tokenizer(encoding_name: str, tokenizer) -> None:
+    """
+    Stores a loaded tokenizer for an encoding. For the default encoding, also binds its
+    encoders for the counting hot path (see `_encode_ordinary` and `_encode_to_buffer`).
+    """
+    global _encode_ordinary, _encode_to_buffer
+    _tokenizers[encoding_name] = tokenizer
+    if encoding_name == _default_encoding_name and not hasattr(tokenizer, "count"):
+        _encode_ordinary = tokenizer.encode_ordinary
+        _encode_to_buffer = getattr(getattr(tokenizer, "_core_bpe", None), "encode_to_tiktoken_buffer", None)
+        if _encode_to_buffer is not None:
+            try:
+                buffer_works = _count_tokens_in_buffer(_encode_to_buffer, _BUFFER_CHECK_TEXT) == len(
+                    _encode_ordinary(_BUFFER_CHECK_TEXT)
+                )
+            except Exception: # e.g. a tiktoken release that changed the private API
+                buffer_works = False
+            if not buffer_works:
+                _encode_to_buffer = None
+
+try:
+    _set_tokenizer(_default_encoding_name, _encoding_backend.get_encoding(_default_encoding_name))
+except Exception:
+    pass
+# Guards the retried initialisation, since files are tokenized from worker threads
+_tokenizer_lock = threading.Lock()
+
+def _get_tokenizer(encoding_name: Optional[str] = None):
+    """
+    Initializes and returns the tiktoken tokenizer for the given (or configured) encoding.
     Caches the tokenizer instance for efficiency.
     """
-    global _tokenizer
-    if _tokenizer is None:
-        try:
-            _tokenizer = tiktoken.get_encoding(CLAUDE_ENCODING_MODEL)
-        except Exception as e:
-            # This might happen if the encoding name is wrong or tiktoken has issues
-            # For cl100k_base, it should generally be available as it's a common one.
-            print(f"Error initializing tokenizer: {e}")
-            raise RuntimeError(f"Could not load the tokenizer '{CLAUDE_ENCODING_MODEL}'. Ensure tiktoken is installed correctly.") from e
-    return _tokenizer
+    encoding_name = get_encoding_name(encoding_name)
+    tokenizer = _tokenizers.get(encoding_name)
+    if tokenizer is None:
+        with _tokenizer_lock:
+            tokenizer = _tokenizers.get(encoding_name)
+            if tokenizer is None:
+                try:
+                    tokenizer = _encoding_backend.get_encoding(encoding_name)
+                    _set_tokenizer(encoding_name, tokenizer)
+                except Exception as e:
+                    # This might happen if the encoding name is wrong or tiktoken has issues
+                    # For cl100k_base, it should generally be available as it's a common one.
+                    print(f"Error initializing tokenizer: {e}")
+                    raise RuntimeError(f"Could not load the tokenizer '{encoding_name}'. Ensure tiktoken is installed correctly.") from e
+    return tokenizer
 
-def count_tokens_for_text(text_content: str) -> int:
+def get_tokenizer_id(encoding_name: Optional[str] = None) -> str:
+    """
+    Returns a string identifying the tokenizer library version and encoding,
+    so that stored token counts can be invalidated when either changes.
+    """
+    backend_version = getattr(_encoding_backend, '__version__', 'unknown')
+    return f"{_encoding_backend.__name__}-{backend_version}/{get_encoding_name(encoding_name)}"
+
+def init_tokenizer(encoding_name: Optional[str] = None) -> None:
+    """
+    Ensures the tokenizer is loaded, e.g. from a worker process initializer,
+    so a failure to load it is reported before any file is processed.
+
+    Raises:
+        RuntimeError: If the tokenizer cannot be initialized.
+    """
+    _get_tokenizer(encoding_name)
+
+def count_tokens_for_text(text_content: str, encoding_name: Optional[str] = None) -> int:
     """
     Counts the number of tokens in the given text content using a Claude-compatible tokenizer.
+    Counts of texts up to MEMO_MAX_TEXT_LENGTH characters are memoised, so repeated
+    identical texts are only tokenized once. Below SPLIT_MIN_TEXT_LENGTH characters, counts
+    of recurring lines are also reused across texts (see `_count_tokens_by_segment`).
 
     Args:
         text_content: The string content to tokenize.
+        encoding_name: Encoding (or model name) to use instead of the configured one (see `get_encoding_name`).
 
     Returns:
         The number of tokens.
-        Returns 0 if the text_content is empty or None.
+        Returns 0 if the text_content is empty, None or only whitespace (like an empty file).
     
     Raises:
         RuntimeError: If the tokenizer cannot be initialized.
     """
-    if not text_content:
+    if not text_content or text_content.isspace():
         return 0
-    
-    tokenizer = _get_tokenizer()
-    tokens = tokenizer.encode(
-        text_content,
-        # disallowed_special=() # Allow all special tokens for counting purposes, consistent with Claude's API
+    if len(text_content) <= MEMO_MAX_TEXT_LENGTH:
+        return _count_tokens_memoised(text_content, encoding_name)
+    if len(text_content) > SPLIT_MIN_TEXT_LENGTH:
+        return sum(count_tokens_for_texts(split_text(text_content), encoding_name=encoding_name))
+    return _count_tokens_by_segment(text_content, encoding_name)
+
+def _count_tokens(text_content: str, encoding_name: Optional[str] = None) -> int:
+    """
+    Counts the tokens of a text with the tokenizer, without memoising or splitting it.
+    Special-token markers such as "<|endoftext|>" are counted as ordinary text.
+    """
+    if encoding_name is None and _encode_ordinary is not None:
+        if _encode_to_buffer is not None and len(text_content) > BUFFER_MIN_TEXT_LENGTH:
+            try:
+                return _count_tokens_in_buffer(_encode_to_buffer, text_content)
+            except UnicodeEncodeError:
+                pass # Lone surrogates; encode_ordinary replaces them
+        return len(_encode_ordinary(text_content))
+    tokenizer = _get_tokenizer(encoding_name)
+    if hasattr(tokenizer, "count"):
+        # Backends such as riptoken count without building the list of tokens
+        return tokenizer.count(text_content)
+    # encode_ordinary skips the special-token scan; markers such as "<|endoftext|>" count as plain text
+    return len(tokenizer.encode_ordinary(text_content))
+
+# Counts of recently seen segments, by encoding name (None for the default encoding)
+_segment_counts = {}
+
+def _count_segments_py(
+    text_content: str,
+    split_points: Iterable[re.Match],
+    segment_counts: dict,
+    count_tokens,
+    encoding_name: Optional[str],
+    max_segment_length: int,
+    max_entries: int
+) -> int:
+    """
+    Sums the token counts of the segments of `text_content` ending at `split_points` and at
+    the end of the text, looking each segment up in `segment_counts` first and storing the
+    counts of new short segments in it (emptying it first if it holds `max_entries`).
+    `_fast.count_segments` is a compiled version of this, used instead when it is built.
+    """
+    token_count = 0
+    start = 0
+    for split_point in itertools.chain(split_points, (None,)):
+        end = split_point.end() if split_point is not None else len(text_content)
+        segment = text_content[start:end]
+        start = end
+        if not segment:
+            continue
+        segment_count = segment_counts.get(segment)
+        if segment_count is None:
+            segment_count = count_tokens(segment, encoding_name)
+            if len(segment) <= max_segment_length:
+                if len(segment_counts) >= max_entries:
+                    segment_counts.clear()
+                segment_counts[segment] = segment_count
+        token_count += segment_count
+    return token_count
+
+try:
+    # Compiled with Cython when it was available at install time
+    from ._fast import count_segments as _count_segments
+except ImportError:
+    _count_segments = _count_segments_py
+
+def _count_tokens_by_segment(text_content: str, encoding_name: Optional[str] = None) -> int:
+    """
+    Counts tokens one segment at a time (see `_SAFE_SPLIT_POINT`), reusing the counts of
+    segments already seen in this process. Segment counts add up exactly to the count of
+    the whole text.
+    """
+    segment_counts = _segment_counts.get(encoding_name)
+    if segment_counts is None:
+        segment_counts = _segment_counts.setdefault(encoding_name, {})
+    return _count_segments(
+        text_content, _SAFE_SPLIT_POINT.finditer(text_content), segment_counts, _count_tokens, encoding_name,
+        SEGMENT_MAX_LENGTH, SEGMENT_CACHE_MAX_ENTRIES
     )
-    return len(tokens)
+
+# Bounded LRU cache of small text counts; lru_cache is safe to call from the worker threads
+_count_tokens_memoised = functools.lru_cache(maxsize=MEMO_MAX_ENTRIES)(_count_tokens_by_segment)
+
+def split_text(text_content: str, target_length: int = SPLIT_TARGET_LENGTH) -> List[str]:
+    """
+    Splits text into pieces of at least `target_length` characters (except the last), each
+    ending at a line break followed by a non-whitespace character other than "/", possibly
+    after indentation (see `_SAFE_SPLIT_POINT`).
+
+    Pre-tokenization with the cl100k_base or o200k_base patterns never merges text across
+    such a point (o200k_base does merge across a line break followed by "/", e.g. ";\n//",
+    which is why those are excluded), so the token counts of the pieces add up exactly to
+    the count of the whole text. Text without such points is not split.
+    """
+    pieces = []
+    start = 0
+    while len(text_content) - start > target_length:
+        split_point = _SAFE_SPLIT_POINT.search(text_content, start + target_length)
+        if split_point is None:
+            break
+        pieces.append(text_content[start:split_point.end()])
+        start = split_point.end()
+    pieces.append(text_content[start:])
+    return pieces
+
+def count_tokens_for_texts(
+    texts: List[str], num_threads: Optional[int] = None, encoding_name: Optional[str] = None
+) -> List[int]:
+    """
+    Counts the number of tokens in each of several texts with a single batched call.
+    The tokenizer encodes the texts concurrently on a pool of threads, with the GIL released.
+    Special-token markers such as "<|endoftext|>" are counted as ordinary text.
+
+    Args:
+        texts: The strings to tokenize.
+        num_threads: Number of encoding threads. Defaults to the CPU count.
+        encoding_name: Encoding (or model name) to use instead of the configured one.
+
+    Returns:
+        The number of tokens of each text, in the same order as `texts`.
+
+    Raises:
+        RuntimeError: If the tokenizer cannot be initialized.
+    """
+    if not texts:
+        return []
+
+    if encoding_name is None and _encode_to_buffer is not None:
+        # Same thread pool as encode_ordinary_batch, but counting from token buffers
+        with ThreadPoolExecutor(num_threads or os.cpu_count() or 1) as executor:
+            return list(executor.map(_count_tokens, texts))
+
+    tokenizer = _get_tokenizer(encoding_name)
+    if not hasattr(tokenizer, "encode_ordinary_batch"):
+        return [_count_tokens(text, encoding_name) if text else 0 for text in texts]
+    token_lists = tokenizer.encode_ordinary_batch(texts, num_threads=num_threads or os.cpu_count() or 1)
+    return [len(tokens) for tokens in token_lists]
+
+def iter_text_pieces(text_stream: TextIO, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Reads a text stream `chunk_size` characters at a time and yields it as pieces ending at
+    line breaks followed by a non-whitespace character other than "/" (safe split points, as
+    in `split_text`), so that the token counts of the pieces add up exactly to the count of
+    the whole text.
+
+    A piece that grows past STREAM_MAX_PIECE_LENGTH without a safe split point is cut at its
+    last line break instead (or at its end), which can shift the total count very slightly.
+    """
+    pending = ""
+    while True:
+        chunk = text_stream.read(chunk_size)
+        if not chunk:
+            break
+        # Only the newly read text (and the line break that may end the previous text) needs searching
+        search_from = max(len(pending) - 1, 0)
+        pending += chunk
+        end = len(pending) - 1 # The character after the last line break is not known yet
+        split_at = pending.rfind("\n", search_from, end)
+        while split_at != -1 and (pending[split_at + 1].isspace() or pending[split_at + 1] == "/"):
+            split_at = pending.rfind("\n", search_from, split_at)
+        if split_at == -1 and len(pending) >= STREAM_MAX_PIECE_LENGTH:
+            split_at = pending.rfind("\n")
+            if split_at == -1:
+                split_at = len(pending) - 1
+        if split_at != -1:
+            yield pending[:split_at + 1]
+            pending = pending[split_at + 1:]
+    if pending:
+        yield pending
+
+def count_tokens_for_pieces(
+    pieces: Iterable[str], batch_size: int = STREAM_BATCH_SIZE, encoding_name: Optional[str] = None
+) -> int:
+    """
+    Counts the total number of tokens in a stream of texts, handing them to
+    `count_tokens_for_texts` `batch_size` at a time.
+    """
+    token_count = 0
+    batch = []
+    for piece in pieces:
+        batch.append(piece)
+        if len(batch) == batch_size:
+            token_count += sum(count_tokens_for_texts(batch, encoding_name=encoding_name))
+            batch = []
+    if batch:
+        token_count += sum(count_tokens_for_texts(batch, encoding_name=encoding_name))
+    return token_count
+
+def count_tokens_for_file(
+    file_path: Union[str, os.PathLike], encoding: str = "utf-8", encoding_name: Optional[str] = None
+) -> int:
+    """
+    Counts the number of tokens in a text file without holding the whole file in memory.
+    The file is read in pieces (see `iter_text_pieces`) that are tokenized in parallel batches.
+    Line endings are normalized to "\n", as when reading the file in text mode.
+
+    Args:
+        file_path: Path to the file.
+        encoding: Text encoding of the file.
+        encoding_name: Tokenizer encoding (or model name) to use instead of the configured one.
+
+    Returns:
+        The number of tokens.
+
+    Raises:
+        OSError: If the file cannot be read.
+        UnicodeDecodeError: If the file cannot be decoded with the given encoding.
+        RuntimeError: If the tokenizer cannot be initialized.
+    """
+    with open(file_path, encoding=encoding) as text_stream:
+        return count_tokens_for_pieces(iter_text_pieces(text_stream), encoding_name=encoding_name)
+
+def _count_tokens_for_path(
+    file_path: Union[str, os.PathLike], encoding: str, encoding_name: Optional[str]
+) -> int:
+    """
+    `count_tokens_for_file` for `count_tokens_for_paths`, naming the file in read and decode errors.
+    """
+    try:
+        return count_tokens_for_file(file_path, encoding, encoding_name)
+    except (OSError, UnicodeDecodeError) as e:
+        raise RuntimeError(f"Could not count the tokens of '{os.fspath(file_path)}': {e}") from e
+
+def count_tokens_for_paths(
+    paths: List[Union[str, os.PathLike]],
+    workers: Optional[int] = None,
+    use_processes: bool = True,
+    encoding: str = "utf-8",
+    encoding_name: Optional[str] = None
+) -> List[int]:
+    """
+    Counts the number of tokens in each of many text files, spreading the files over a pool
+    of worker processes (each with its own tokenizer) so that counting scales across CPU cores
+    even with a backend that does not release the GIL. Files are handed to the workers
+    PATHS_CHUNK_SIZE at a time.
+
+    The first file that cannot be read or decoded stops the whole call, and no counts are
+    returned; the error names that file. To count what can be counted and skip the rest, use
+    `count_tokens_for_file` per file instead.
+
+    Args:
+        paths: Paths to the files.
+        workers: Number of workers. Defaults to the CPU count.
+        use_processes: Use worker processes; if False, use threads, which is cheaper to start
+            and scales as well with backends that release the GIL (such as tiktoken).
+        encoding: Text encoding of the files.
+        encoding_name: Tokenizer encoding (or model name) to use instead of the configured one.
+
+    Returns:
+        The number of tokens of each file, in the same order as `paths`.
+
+    Raises:
+        RuntimeError: If a file cannot be read or decoded with the given encoding (naming the
+            file, caused by the OSError or UnicodeDecodeError), or if the tokenizer cannot be
+            initialized.
+    """
+    workers = workers or os.cpu_count() or 1
+    count_file = functools.partial(_count_tokens_for_path, encoding=encoding, encoding_name=encoding_name)
+    if workers == 1 or len(paths) <= PATHS_CHUNK_SIZE:
+        return [count_file(path) for path in paths]
+
+    executor: Executor
+    if use_processes:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_tokenizer, initargs=(encoding_name,))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    with executor:
+        return list(executor.map(count_file, paths, chunksize=PATHS_CHUNK_SIZE))
 
 if __name__ == '__main__':
     # Example usage, can be run with `python -m codetokencalculator.tokenizer`
@@ -67,7 +486,7 @@ if __name__ == '__main__':
     """
     empty_text = ""
     
-    print(f"Tokenizer: {CLAUDE_ENCODING_MODEL}")
+    print(f"Tokenizer: {get_encoding_name()} ({_encoding_backend.__name__})")
     
     tokens_1 = count_tokens_for_text(sample_text_1)
     print(f"'{sample_text_1}' -> Tokens: {tokens_1}")
@@ -0,0 +1,58 @@
+# codetokencalculator/tests/conftest.py
+
+"""
+Shared fixtures. The tests tokenize with small offline stand-ins for the cl100k_base and
+o200k_base encodings, so they run without downloading the real vocabularies.
+"""
+
+import pytest
+import tiktoken
+import tiktoken_ext.openai_public
+
+from codetokencalculator import tokenizer
+
+ENCODING_NAMES = ("cl100k_base", "o200k_base")
+
+
+def _synthetic_ranks() -> dict:
+    """
+    Returns byte-level ranks plus a few merges. Merges of a line break with the character
+    after it come first, so counts change wherever pre-tokenization joins a line break
+    with what follows it (e.g. ";\\n//" under o200k_base), which is where splitting is unsafe.
+    """
+    ranks = {bytes([i]): i for i in range(256)}
+    for extra in [b"\n" + bytes([i]) for i in range(128)] + [b"  ", b"    ", b"de", b"def"]:
+        ranks.setdefault(extra, len(ranks))
+    return ranks
+
+
+def _synthetic_encoding(encoding_name: str) -> tiktoken.Encoding:
+    """
+    Builds an encoding with the real pre-tokenization pattern and special tokens of
+    `encoding_name`, but the ranks of `_synthetic_ranks`.
+    """
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(tiktoken_ext.openai_public, "load_tiktoken_bpe", lambda *args, **kwargs: _synthetic_ranks())
+        constructor_args = tiktoken_ext.openai_public.ENCODING_CONSTRUCTORS[encoding_name]()
+    return tiktoken.Encoding(**constructor_args)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def synthetic_encodings() -> dict:
+    """
+    Installs the stand-in encodings as the loaded tokenizers, and returns them by name.
+    """
+    encodings = {name: _synthetic_encoding(name) for name in ENCODING_NAMES}
+    for name, encoding in encodings.items():
+        tokenizer._set_tokenizer(name, encoding)
+    return encodings
+
+
+@pytest.fixture(autouse=True)
+def clear_count_caches():
+    """
+    Empties the in-process count caches, so each test tokenizes its texts afresh.
+    """
+    tokenizer._count_tokens_memoised.cache_clear()
+    tokenizer._segment_counts.clear()
+    yield
@@ -0,0 +1,240 @@
+# codetokencalculator/tests/test_calculator.py
+
+import functools
+import json
+import os
+import re
+from collections.abc import Sequence
+
+import pytest
+
+from codetokencalculator import calculator
+from codetokencalculator.cache import TokenCountCache
+from codetokencalculator.calculator import process_directory, process_file
+from codetokencalculator.tokenizer import count_tokens_for_text, iter_text_pieces
+
+FILE_REGEX = r".*(\.(py|txt|js)$|Dockerfile|Makefile)"
+
+
+@pytest.fixture
+def sample_tree(tmp_path):
+    """
+    A directory with files to count, files to skip for various reasons, and excluded directories.
+    """
+    (tmp_path / "file1.py").write_text("def hello():\n  print('world') # Python comment")
+    (tmp_path / "file2.txt").write_text("This is some text with numbers 123 and symbols !@#.")
+    (tmp_path / "binary_file.bin").write_bytes(b"binary\0content\0nulls")
+    (tmp_path / "empty_file.py").write_text("")
+    (tmp_path / "whitespace_file.js").write_text("   \n\t  \n ")
+    (tmp_path / "Dockerfile").write_text("FROM python:3.9-slim\nWORKDIR /app")
+    (tmp_path / "file_to_exclude.log").write_text("This is a log file and should be excluded.")
+    (tmp_path / "another_to_exclude.tmp").write_text("Temporary data.")
+    (tmp_path / "document.Py").write_text("# Case test for exclusion")
+
+    sub_dir = tmp_path / "subdir"
+    sub_dir.mkdir()
+    (sub_dir / "file3.js").write_text("console.log('test from subdir'); // JS comment")
+
+    excluded_dir_git = tmp_path / ".git"
+    excluded_dir_git.mkdir()
+    (excluded_dir_git / "config").write_text("some git config data")
+    (excluded_dir_git / "HEAD").write_text("ref: refs/heads/main")
+
+    excluded_dir_node = tmp_path / "node_modules"
+    excluded_dir_node.mkdir()
+    (excluded_dir_node / "some_package.js").write_text("var x = 1;")
+    return tmp_path
+
+
+def _statuses(data: dict) -> dict:
+    return {f_data["path"]: f_data["status"] for f_data in data["files"]}
+
+
+def test_process_directory(sample_tree):
+    data = process_directory(
+        str(sample_tree),
+        file_regex_pattern=FILE_REGEX,
+        exclude_extensions={".log", "tmp"}
+    )
+    assert data["errors"] == []
+    tokens = {f_data["path"]: f_data["tokens"] for f_data in data["files"]}
+    statuses = _statuses(data)
+
+    counted = ["Dockerfile", "file1.py", "file2.txt", os.path.join("subdir", "file3.js")]
+    for path in counted:
+        assert tokens[path] == count_tokens_for_text((sample_tree / path).read_text())
+        assert statuses[path] == "Processed"
+    assert tokens["empty_file.py"] == 0
+    assert tokens["whitespace_file.js"] == 0
+    for path in ["binary_file.bin", "document.Py", "file_to_exclude.log"]:
+        assert statuses[path].startswith("Skipped (did not match regex")
+    assert not any(path.startswith((".git", "node_modules")) for path in statuses)
+
+    summary = data["summary"]
+    assert summary["total_files_processed_successfully"] == 6
+    assert summary["total_tokens"] == sum(tokens[path] for path in counted)
+    assert sorted(summary["directories_explicitly_skipped"]) == [".git", "node_modules"]
+    assert [f_data["path"] for f_data in data["files"]] == sorted(statuses)
+
+
+def test_process_directory_excluded_extensions(sample_tree):
+    # Case-insensitive, leading dot optional
+    data = process_directory(str(sample_tree), r".*", exclude_extensions={".PY", "log"})
+    statuses = _statuses(data)
+    assert statuses["document.Py"] == "Skipped (excluded extension: .py)"
+    assert statuses["file1.py"] == "Skipped (excluded extension: .py)"
+    assert statuses["file_to_exclude.log"] == "Skipped (excluded extension: .log)"
+    assert statuses["another_to_exclude.tmp"] == "Skipped (extension .tmp not in default inclusion list)"
+    assert statuses["file2.txt"] == "Processed"
+
+
+def test_process_directory_serial_matches_parallel(sample_tree):
+    serial = process_directory(str(sample_tree), FILE_REGEX, max_workers=1)
+    parallel = process_directory(str(sample_tree), FILE_REGEX, max_workers=4)
+    assert list(serial["files"]) == list(parallel["files"])
+    assert serial["summary"] == parallel["summary"]
+
+
+def test_process_directory_non_existent_directory():
+    data = process_directory("a_s_d_f_path_does_not_exist_z_x_c_v", r".*")
+    assert "not a valid directory" in data["errors"][0]
+
+
+def test_process_directory_invalid_regex(sample_tree):
+    data = process_directory(str(sample_tree), file_regex_pattern="*invalid[")
+    assert "Invalid regex pattern" in data["errors"][0]
+
+
+def test_streamed_count_matches_whole_file(tmp_path, monkeypatch):
+    file_path = tmp_path / "large.c"
+    file_path.write_text("".join(
+        f"int x{i} = {i}; // value\n" if i % 3 else f"    /* {i} */\n\n// {i}\n" for i in range(2000)
+    ))
+    monkeypatch.setattr(calculator, "CHUNK_THRESHOLD", calculator.BINARY_SNIFF_SIZE)
+    # Small reads, so the file is streamed as many pieces
+    monkeypatch.setattr(calculator, "iter_text_pieces", functools.partial(iter_text_pieces, chunk_size=100))
+
+    whole_count, _ = process_file(file_path, set(), exact=True)
+    assert process_file(file_path, set()) == (whole_count, "Processed (counted in chunks)")
+    assert whole_count == count_tokens_for_text(file_path.read_text())
+
+
+def test_process_file_cache_hit_and_miss(tmp_path, monkeypatch):
+    file_path = tmp_path / "module.py"
+    file_path.write_text("def f():\n    return 1\n")
+    cache = TokenCountCache(tmp_path / "counts.db")
+    first = process_file(file_path, set(), cache=cache)
+    cache.save()
+    cache.close()
+
+    def fail(text):
+        raise AssertionError("file was tokenized on a cache hit")
+
+    cache = TokenCountCache(tmp_path / "counts.db")
+    with monkeypatch.context() as patch:
+        patch.setattr(calculator, "count_tokens_for_text", fail)
+        assert process_file(file_path, set(), cache=cache) == first
+
+    file_path.write_text("def f():\n    return 12345\n") # Different size, so a different key
+    assert process_file(file_path, set(), cache=cache) == (count_tokens_for_text(file_path.read_text()), None)
+    cache.close()
+
+
+def test_hard_links_are_counted_once(tmp_path):
+    (tmp_path / "a.py").write_text("print('a')\n")
+    try:
+        os.link(tmp_path / "a.py", tmp_path / "b.py")
+    except OSError:
+        pytest.skip("hard links not supported")
+    data = process_directory(str(tmp_path), r".*")
+    statuses = _statuses(data)
+    assert statuses["a.py"] == "Processed"
+    assert statuses["b.py"] == "Skipped (hard link or symlink to a file already counted)"
+    assert data["summary"]["total_files_processed_successfully"] == 1
+    assert data["summary"]["total_files_skipped"] == 1
+
+
+def test_hard_link_with_skipped_name_does_not_hide_counted_link(tmp_path):
+    (tmp_path / "a.bak").write_text("print('b')\n")
+    try:
+        os.link(tmp_path / "a.bak", tmp_path / "b.py")
+    except OSError:
+        pytest.skip("hard links not supported")
+    data = process_directory(str(tmp_path), r".*")
+    statuses = _statuses(data)
+    assert statuses["a.bak"] == "Skipped (extension .bak not in default inclusion list)"
+    assert statuses["b.py"] == "Processed"
+    assert data["summary"]["total_tokens"] == count_tokens_for_text("print('b')\n")
+
+
+@pytest.mark.filterwarnings("ignore:Possible nested set:FutureWarning")
+@pytest.mark.parametrize("pattern, path, matches", [
+    (r"^\w+\.py$", "café.py", True), # Unicode \w, as in `re`
+    (r"\bcafé\b", "café.py", True),
+    (r"[[:digit:]]\.py$", "1.py", False), # A set of characters in `re`, not a POSIX class
+    (r"^a\.py$", "a.py\n", True), # `re` also matches $ before a trailing newline
+    (r"(\w)\1\.py$", "aa.py", True), # Backreferences are not supported by RE2
+    (r"\.py", "x.py", True),
+])
+def test_compile_file_regex_matches_like_re(pattern, path, matches):
+    assert bool(calculator._compile_file_regex(pattern).search(path)) == matches
+
+
+@pytest.mark.filterwarnings("ignore:Possible nested set:FutureWarning")
+@pytest.mark.parametrize("pattern", [r"^\w+\.py$", r"\d", r"[[:digit:]]\.py", r"\.py$", r"(\w)\1"])
+def test_compile_file_regex_uses_re_for_syntax_re2_treats_differently(pattern):
+    assert isinstance(calculator._compile_file_regex(pattern), re.Pattern)
+
+
+@pytest.mark.skipif(calculator.re2 is None, reason="google-re2 not installed")
+@pytest.mark.parametrize("pattern", [r"\.py", r"^src/.*\.(py|js)", r"\\w"]) # The last is an escaped backslash
+def test_compile_file_regex_uses_re2_when_matching_is_the_same(pattern):
+    assert not isinstance(calculator._compile_file_regex(pattern), re.Pattern)
+
+
+def test_compile_file_regex_rejects_patterns_invalid_in_re():
+    with pytest.raises(re.error):
+        calculator._compile_file_regex(r"\pL\.py$") # Valid in RE2, a bad escape in `re`
+
+
+def test_file_results_behaves_like_a_list():
+    file_results = [
+        {"path": "b.py", "tokens": 3, "status": "Processed"},
+        {"path": "a.bin", "tokens": None, "status": "Skipped (binary)"},
+        {"path": "c.py", "tokens": 0, "status": "Empty or whitespace-only file"},
+    ]
+    files = calculator.FileResults()
+    for file_result in file_results:
+        files.append(file_result)
+
+    assert isinstance(files, Sequence)
+    assert files == file_results and files == list(files)
+    assert files[:2] == file_results[:2]
+    assert files[::-1] == file_results[::-1]
+    assert files[-1] == file_results[-1]
+    assert file_results[1] in files
+    assert files.index(file_results[2]) == 2
+    assert json.loads(json.dumps(files.to_list())) == file_results
+
+    files.sort(key=lambda f: f["path"], reverse=True)
+    assert [f["path"] for f in files] == ["c.py", "b.py", "a.bin"]
+    files.sort_by_path()
+    assert files == sorted(file_results, key=lambda f: f["path"])
+    assert [files[i]["path"] for i in files.order_by_tokens()] == ["b.py", "c.py", "a.bin"]
+
+
+def test_iter_directory_yields_files_in_path_order(tmp_path):
+    for rel_path in ["a/z.py", "a-b.py", "a.py", "a/b/c.py", "a/b.py", "ab/x.py", "b.py"]:
+        (tmp_path / rel_path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / rel_path).write_text("x = 1\n")
+    streamed_paths = [item["path"] for item in calculator.iter_directory(str(tmp_path), r".*") if "path" in item]
+    assert streamed_paths == sorted(streamed_paths)
+    assert streamed_paths == [f["path"] for f in process_directory(str(tmp_path), r".*")["files"]]
+    assert streamed_paths[:3] == ["a-b.py", "a.py", os.path.join("a", "b.py")]
+
+
+def test_process_file_name_check_can_be_left_to_the_caller(tmp_path):
+    file_path = tmp_path / "notes.bak"
+    file_path.write_text("print('b')\n")
+    assert process_file(file_path, set()) == (None, "Skipped (extension .bak not in default inclusion list)")
+    assert process_file(file_path, set(), check_name=False) == (count_tokens_for_text("print('b')\n"), None)
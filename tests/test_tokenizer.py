@@ -0,0 +1,200 @@
+# codetokencalculator/tests/test_tokenizer.py
+
+import io
+import multiprocessing
+import random
+
+import pytest
+
+from codetokencalculator import tokenizer
+from codetokencalculator.tokenizer import (
+    count_tokens_for_file, count_tokens_for_paths, count_tokens_for_pieces, count_tokens_for_text, iter_text_pieces,
+    split_text
+)
+from conftest import ENCODING_NAMES
+
+SAMPLE_CODE = (
+    "#include <stdio.h>\n"
+    "\n"
+    "int main(void) {\n"
+    "    int x = 12345;\n"
+    "    printf(\"%d\\n\", x);\n"
+    "    /* block\n"
+    "     * comment */\n"
+    "    return 0;\n"
+    "}\n"
+    "// line comment\n"
+    "def hello():\n"
+    "\tprint('world')  # it's here\n"
+    "\n"
+    "\n"
+    "    \n"
+    "café = \"naïve\"\n"
+    "x = [1, 2, 3]; // trailing\n"
+    "  \n"
+    "</div>\n"
+    "'s 'll\n"
+)
+
+# Characters that exercise the pre-tokenization rules around line breaks
+FUZZ_ALPHABET = ["\n", "\n", " ", "  ", "\t", "/", "//", ";", "{", "}", "*", "'", "'s", "a", "Ab", "é", "1", "42", "#"]
+
+
+def _count(text: str, encoding_name: str) -> int:
+    return tokenizer._count_tokens(text, encoding_name)
+
+
+@pytest.mark.parametrize("encoding_name", ENCODING_NAMES)
+def test_split_text_counts_add_up(encoding_name):
+    text = SAMPLE_CODE * 20
+    pieces = split_text(text, target_length=1)
+    assert len(pieces) > 100
+    assert "".join(pieces) == text
+    assert sum(_count(piece, encoding_name) for piece in pieces) == _count(text, encoding_name)
+
+
+@pytest.mark.parametrize("encoding_name", ENCODING_NAMES)
+def test_split_text_counts_add_up_on_random_text(encoding_name):
+    rng = random.Random(0)
+    for _ in range(300):
+        text = "".join(rng.choices(FUZZ_ALPHABET, k=rng.randint(1, 60)))
+        pieces = split_text(text, target_length=1)
+        assert "".join(pieces) == text
+        assert sum(_count(piece, encoding_name) for piece in pieces) == _count(text, encoding_name), repr(text)
+
+
+def test_split_text_keeps_line_break_before_slash_under_o200k():
+    # o200k_base pre-tokenizes ";\n//" as one piece, so the text must not be split before "//"
+    text = ";\n// x"
+    assert split_text(text, target_length=1) == [text]
+    assert tokenizer._count_tokens_by_segment(text, "o200k_base") == _count(text, "o200k_base")
+
+
+def test_segment_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(tokenizer, "SEGMENT_CACHE_MAX_ENTRIES", 10)
+    text = "".join(f"x{i} = {i}\n" for i in range(100))
+    assert tokenizer._count_tokens_by_segment(text) == _count(text, None)
+    assert 0 < len(tokenizer._segment_counts[None]) <= 10
+
+
+@pytest.mark.parametrize("encoding_name", ENCODING_NAMES)
+def test_segment_counts_match_whole_text(encoding_name):
+    text = SAMPLE_CODE * 50
+    assert tokenizer._count_tokens_by_segment(text, encoding_name) == _count(text, encoding_name)
+
+
+@pytest.mark.parametrize("encoding_name", ENCODING_NAMES)
+@pytest.mark.parametrize("chunk_size", [1, 7, 64])
+def test_streamed_pieces_match_whole_text(encoding_name, chunk_size):
+    text = SAMPLE_CODE * 10
+    pieces = list(iter_text_pieces(io.StringIO(text), chunk_size=chunk_size))
+    assert "".join(pieces) == text
+    assert count_tokens_for_pieces(pieces, encoding_name=encoding_name) == _count(text, encoding_name)
+
+
+@pytest.mark.parametrize("encoding_name", ENCODING_NAMES)
+def test_count_tokens_for_file_matches_whole_text(tmp_path, encoding_name):
+    file_path = tmp_path / "sample.c"
+    file_path.write_text(SAMPLE_CODE * 10, encoding="utf-8")
+    assert count_tokens_for_file(file_path, encoding_name=encoding_name) == _count(SAMPLE_CODE * 10, encoding_name)
+
+
+def test_count_tokens_for_text_with_lone_surrogates():
+    text = "abc\ud800def" * 2000 # Long enough for the buffer-returning encoder
+    assert len(text) > tokenizer.BUFFER_MIN_TEXT_LENGTH
+    assert count_tokens_for_text(text) == len(tokenizer._get_tokenizer().encode_ordinary(text))
+
+
+def test_count_tokens_for_text_empty_or_whitespace():
+    assert count_tokens_for_text("") == 0
+    assert count_tokens_for_text(" \n\t\n") == 0
+
+
+@pytest.mark.parametrize("encode_to_buffer", [
+    lambda text, allowed_special: b"", # Wrong result
+    lambda text: b"", # Changed signature
+])
+def test_set_tokenizer_rejects_unusable_buffer_encoder(monkeypatch, synthetic_encodings, encode_to_buffer):
+    class BrokenCoreEncoding:
+        encode_ordinary = synthetic_encodings["cl100k_base"].encode_ordinary
+        _core_bpe = type("CoreBPE", (), {"encode_to_tiktoken_buffer": staticmethod(encode_to_buffer)})()
+
+    encoding_name = tokenizer.get_encoding_name()
+    monkeypatch.setitem(tokenizer._tokenizers, encoding_name, tokenizer._tokenizers[encoding_name])
+    monkeypatch.setattr(tokenizer, "_encode_ordinary", tokenizer._encode_ordinary)
+    monkeypatch.setattr(tokenizer, "_encode_to_buffer", tokenizer._encode_to_buffer)
+    tokenizer._set_tokenizer(encoding_name, BrokenCoreEncoding())
+    assert tokenizer._encode_to_buffer is None
+    text = "x = 1\n" * 1000
+    assert count_tokens_for_text(text) == len(synthetic_encodings["cl100k_base"].encode_ordinary(text))
+
+
+def test_set_tokenizer_keeps_working_buffer_encoder(synthetic_encodings):
+    if not hasattr(synthetic_encodings["cl100k_base"]._core_bpe, "encode_to_tiktoken_buffer"):
+        pytest.skip("tiktoken has no buffer encoder")
+    assert tokenizer._encode_to_buffer is not None
+
+
+SEGMENT_LOOP_TEXTS = ["", "x", "\n", "a\nb\n", "a\n\n  b\n/c\nd", SAMPLE_CODE * 3, "x = 1\n" * 20]
+
+
+@pytest.mark.parametrize("text", SEGMENT_LOOP_TEXTS)
+def test_python_segment_loop_matches_whole_text(text):
+    segment_counts = {}
+    split_points = tokenizer._SAFE_SPLIT_POINT.finditer(text)
+    assert tokenizer._count_segments_py(
+        text, split_points, segment_counts, tokenizer._count_tokens, None, 16, 4
+    ) == _count(text, None)
+    assert len(segment_counts) <= 4 and all(len(segment) <= 16 for segment in segment_counts)
+
+
+@pytest.mark.parametrize("text", SEGMENT_LOOP_TEXTS)
+@pytest.mark.parametrize("max_entries", [1, 4, 1000])
+def test_compiled_segment_loop_matches_python(text, max_entries):
+    fast = pytest.importorskip("codetokencalculator._fast")
+    split_points = list(tokenizer._SAFE_SPLIT_POINT.finditer(text))
+    python_counts, compiled_counts = {"stale": 1}, {"stale": 1}
+    args = (tokenizer._count_tokens, None, 16, max_entries)
+    assert tokenizer._count_segments_py(text, iter(split_points), python_counts, *args) == fast.count_segments(
+        text, iter(split_points), compiled_counts, *args
+    )
+    assert python_counts == compiled_counts
+
+
+def _paths_modes():
+    modes = [
+        pytest.param({"workers": 1}, id="serial"),
+        pytest.param({"workers": 3, "use_processes": False}, id="threads"),
+    ]
+    # Worker processes inherit the stand-in encodings only when forked
+    if multiprocessing.get_start_method() == "fork":
+        modes.append(pytest.param({"workers": 2, "use_processes": True}, id="processes"))
+    return modes
+
+
+@pytest.fixture
+def text_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(tokenizer, "PATHS_CHUNK_SIZE", 2) # So that 7 files are spread over workers
+    texts = [SAMPLE_CODE * i + f"x = {i}\n" for i in range(7)]
+    paths = []
+    for i, text in enumerate(texts):
+        paths.append(tmp_path / f"file{i}.py")
+        paths[-1].write_text(text, encoding="utf-8")
+    return paths, texts
+
+
+@pytest.mark.parametrize("mode", _paths_modes())
+def test_count_tokens_for_paths_modes_agree(text_files, mode):
+    paths, texts = text_files
+    assert count_tokens_for_paths(paths, **mode) == [count_tokens_for_text(text) for text in texts]
+
+
+@pytest.mark.parametrize("mode", _paths_modes())
+def test_count_tokens_for_paths_names_the_failing_file(text_files, tmp_path, mode):
+    paths, _ = text_files
+    bad_path = tmp_path / "latin1.py"
+    bad_path.write_bytes(b"caf\xe9\n")
+    with pytest.raises(RuntimeError, match="latin1.py"):
+        count_tokens_for_paths(paths[:3] + [bad_path] + paths[3:], **mode)
+    with pytest.raises(RuntimeError, match="missing.py"):
+        count_tokens_for_paths(paths + [tmp_path / "missing.py"], **mode)